@@ -0,0 +1,341 @@
+"""Benchmarks of the functions in bikes over networks of many sizes.
+
+For each network size, a synthetic network is made from stations.csv (see
+the synthetic module) and each function in FUNCTIONS is timed on it, both
+on a list of stations and on a StationTable. A function that changes the
+stations is timed on a fresh copy each time, except that rent_bike and
+return_bike, which change one station, first have that station's bikes and
+docks available set back to where they started. The results give the
+operations per second, the seconds per operation and the peak memory
+allocated by one call, and how the time per call grows with the size of
+the network.
+
+Results can be saved as JSON and compared with an earlier run, flagging
+every function that got slower by more than a threshold.
+
+clean_data can also be compared with the cell-by-cell conversion it
+replaced, on a table of millions of cells.
+
+Run this module to benchmark the default sizes, for example:
+    python benchmark.py --output new.json --compare old.json
+or to compare the two ways of converting cells on 7 million cells:
+    python benchmark.py --clean-data 1000000
+"""
+
+import argparse
+import json
+import math
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+from bikes import (ID, BIKES_AVAILABLE, DOCKS_AVAILABLE, StationTable,
+                   clean_data, get_nearest_station, get_station_info,
+                   get_stations_with_n_docks, get_total, redistribute_bikes,
+                   rent_bike, return_bike)
+import synthetic
+
+# The network sizes benchmarked by default.
+SIZES = [1000, 10000, 100000, 1000000]
+
+# The functions benchmarked, in the order they are reported.
+FUNCTIONS = ['clean_data', 'get_station_info', 'get_total',
+             'get_stations_with_n_docks', 'get_nearest_station', 'rent_bike',
+             'return_bike', 'redistribute_bikes']
+
+# The ways the stations are given to the functions.
+FORMS = ['list', 'table']
+
+# The least time, in seconds, spent timing each function at each size.
+MIN_SECONDS = 0.2
+
+# By default, a result is flagged as a regression if it makes fewer
+# operations per second than the same result in the baseline by more than
+# this fraction.
+THRESHOLD = 0.2
+
+# The number of random station ids or locations used per operation.
+QUERIES = 1000
+
+# The number of stations, of 7 cells each, converted by
+# compare_clean_data by default.
+CLEAN_DATA_ROWS = 1000000
+
+
+def _time_calls(call: Callable[[int], object], min_seconds: float,
+                setup: Callable[[int], None] = None) -> float:
+    """Return the average number of seconds taken by call(i) for i = 0, 1,
+    2, ... over at least min_seconds of calls. If setup is given, setup(i)
+    is called, untimed, before each call(i).
+    """
+
+    calls = 0
+    elapsed = 0.0
+    while elapsed < min_seconds:
+        if setup is not None:
+            setup(calls)
+        began = time.perf_counter()
+        call(calls)
+        elapsed += time.perf_counter() - began
+        calls += 1
+    return elapsed / calls
+
+
+def _peak_bytes(call: Callable[[int], object],
+                setup: Callable[[int], None] = None) -> int:
+    """Return the most memory, in bytes, allocated at once during call(0),
+    after setup(0) if setup is given.
+    """
+
+    if setup is not None:
+        setup(0)
+    tracemalloc.start()
+    try:
+        call(0)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _cases(stations: List["Station"], form: str,
+           seed: int) -> Dict[str, tuple]:
+    """Return a dict mapping each function name in FUNCTIONS that can be
+    benchmarked in form to a (call, setup) pair, where call(i) makes one
+    operation on stations given in form and setup(i), if setup is not
+    None, prepares the stations before call(i).
+    """
+
+    generator = random.Random(seed)
+    station_ids = [generator.choice(stations)[ID] for _ in range(QUERIES)]
+    locations = [(generator.uniform(43.6, 43.75),
+                  generator.uniform(-79.5, -79.3)) for _ in range(QUERIES)]
+    make = StationTable if form == 'table' else \
+        (lambda original: [station[:] for station in original])
+    subject = make(stations)
+    fresh = [subject]
+
+    row_of = {station[ID]: row for row, station in enumerate(stations)}
+
+    def refresh(i: int) -> None:
+        """Replace the stations being changed with a fresh copy."""
+
+        fresh[0] = make(stations)
+
+    def restore(i: int) -> None:
+        """Set the bikes and docks available of the station changed by
+        call(i) back to where they started, so that repeated rentals and
+        returns do not drift its stock.
+        """
+
+        row = row_of[station_ids[i % QUERIES]]
+        subject[row][BIKES_AVAILABLE] = stations[row][BIKES_AVAILABLE]
+        subject[row][DOCKS_AVAILABLE] = stations[row][DOCKS_AVAILABLE]
+
+    cases = {
+        'get_station_info': (lambda i: get_station_info(
+            station_ids[i % QUERIES], subject), None),
+        'get_total': (lambda i: get_total(BIKES_AVAILABLE, subject), None),
+        'get_stations_with_n_docks': (lambda i: get_stations_with_n_docks(
+            i % 30, subject), None),
+        'get_nearest_station': (lambda i: get_nearest_station(
+            *locations[i % QUERIES], i % 2 == 0, subject), None),
+        'rent_bike': (lambda i: rent_bike(station_ids[i % QUERIES], subject),
+                      restore),
+        'return_bike': (lambda i: return_bike(station_ids[i % QUERIES],
+                                              subject), restore),
+        'redistribute_bikes': (lambda i: redistribute_bikes(fresh[0]),
+                               refresh),
+    }
+    if form == 'list':
+        rows = [[str(item) for item in station] for station in stations]
+        cells = [None]
+
+        def fresh_cells(i: int) -> None:
+            """Make a fresh copy of the unconverted rows."""
+
+            cells[0] = [row[:] for row in rows]
+
+        cases['clean_data'] = (lambda i: clean_data(cells[0]), fresh_cells)
+    return cases
+
+
+def _clean_cells(data: List[list]) -> None:
+    """Convert each string in data as clean_data does, one cell at a time.
+    This is how clean_data worked before it converted whole columns.
+    """
+
+    for info_list in data:
+        for i in range(len(info_list)):
+            if info_list[i].lstrip('-+').replace('.', '', 1).isnumeric():
+                if float(info_list[i]).is_integer():
+                    info_list[i] = int(float(info_list[i]))
+                else:
+                    info_list[i] = float(info_list[i])
+
+
+def compare_clean_data(rows: int = CLEAN_DATA_ROWS,
+                       seed: int = 0) -> Tuple[float, float]:
+    """Return the seconds taken to convert the cells of a synthetic network
+    of rows stations, written as strings, one cell at a time and with
+    clean_data.
+
+    >>> cell_seconds, column_seconds = compare_clean_data(100)
+    >>> cell_seconds > 0 and column_seconds > 0
+    True
+    """
+
+    stations = synthetic.synthetic_stations(rows, seed=seed)
+    cells = [[str(item) for item in station] for station in stations]
+    seconds = []
+    for convert in [_clean_cells, clean_data]:
+        data = [row[:] for row in cells]
+        began = time.perf_counter()
+        convert(data)
+        seconds.append(time.perf_counter() - began)
+        if data != stations:
+            raise AssertionError('{} converted the cells wrongly'.format(
+                convert.__name__))
+    return seconds[0], seconds[1]
+
+
+def run_benchmarks(sizes: List[int] = SIZES,
+                   functions: List[str] = FUNCTIONS,
+                   forms: List[str] = FORMS,
+                   min_seconds: float = MIN_SECONDS,
+                   seed: int = 0) -> List[Dict[str, object]]:
+    """Return a list of results, one for each function in functions timed
+    on a synthetic network of each size in sizes given in each form in
+    forms. Each result is a dict of the function, the form, the size, the
+    operations per second, the seconds per operation, the peak bytes
+    allocated by one operation, and the scaling exponent: how the time per
+    operation grew since the previous size, as a power of the size.
+
+    >>> results = run_benchmarks([100, 200], ['get_total'], ['list'], 0.01)
+    >>> [(result['function'], result['size']) for result in results]
+    [('get_total', 100), ('get_total', 200)]
+    >>> results[0]['scaling_exponent'] is None
+    True
+    """
+
+    seed_stations = synthetic.load_seed_stations()
+    results = []
+    previous = {}
+    for size in sizes:
+        stations = synthetic.synthetic_stations(size, seed_stations, seed)
+        for form in forms:
+            cases = _cases(stations, form, seed)
+            for function in functions:
+                if function not in cases:
+                    continue
+                call, setup = cases[function]
+                seconds = _time_calls(call, min_seconds, setup)
+                exponent = None
+                if (function, form) in previous:
+                    previous_size, previous_seconds = previous[function, form]
+                    exponent = round(math.log(seconds / previous_seconds)
+                                     / math.log(size / previous_size), 3)
+                previous[function, form] = (size, seconds)
+                results.append({'function': function, 'form': form,
+                                'size': size,
+                                'ops_per_second': 1 / seconds,
+                                'seconds_per_op': seconds,
+                                'peak_bytes': _peak_bytes(call, setup),
+                                'scaling_exponent': exponent})
+    return results
+
+
+def find_regressions(baseline: List[Dict[str, object]],
+                     results: List[Dict[str, object]],
+                     threshold: float = THRESHOLD) -> List[Dict[str, object]]:
+    """Return the results in results that make fewer operations per second
+    than the result for the same function, form and size in baseline by
+    more than the fraction threshold, each with its baseline operations per
+    second and the change as a fraction.
+
+    >>> old = [{'function': 'get_total', 'form': 'list', 'size': 10, \
+                'ops_per_second': 100.0}]
+    >>> new = [{'function': 'get_total', 'form': 'list', 'size': 10, \
+                'ops_per_second': 50.0}]
+    >>> find_regressions(old, new)[0]['change']
+    -0.5
+    >>> find_regressions(old, old)
+    []
+    """
+
+    before = {(result['function'], result['form'], result['size']):
+              result['ops_per_second'] for result in baseline}
+    regressions = []
+    for result in results:
+        key = (result['function'], result['form'], result['size'])
+        if key not in before:
+            continue
+        change = result['ops_per_second'] / before[key] - 1
+        if change < -threshold:
+            regression = dict(result)
+            regression['baseline_ops_per_second'] = before[key]
+            regression['change'] = round(change, 3)
+            regressions.append(regression)
+    return regressions
+
+
+def _report(results: List[Dict[str, object]]) -> None:
+    """Print results as a table."""
+
+    print('{:>26} {:>5} {:>8} {:>12} {:>12} {:>12} {:>8}'.format(
+        'function', 'form', 'size', 'ops/s', 's/op', 'peak bytes',
+        'scaling'))
+    for result in sorted(results, key=lambda result: (
+            FUNCTIONS.index(result['function']), result['form'],
+            result['size'])):
+        exponent = result['scaling_exponent']
+        print('{function:>26} {form:>5} {size:>8} {ops_per_second:>12.1f} '
+              '{seconds_per_op:>12.3g} {peak_bytes:>12}'.format(**result),
+              '{:>8}'.format('' if exponent is None else
+                             '{:.2f}'.format(exponent)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--functions', nargs='+', default=FUNCTIONS,
+                        choices=FUNCTIONS)
+    parser.add_argument('--forms', nargs='+', default=FORMS, choices=FORMS)
+    parser.add_argument('--min-seconds', type=float, default=MIN_SECONDS)
+    parser.add_argument('--output', help='save the results as JSON here')
+    parser.add_argument('--compare', help='JSON results of an earlier run')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    parser.add_argument('--clean-data', type=int, metavar='ROWS',
+                        help='only compare ways of converting cells')
+    arguments = parser.parse_args()
+
+    if arguments.clean_data:
+        by_cell, by_column = compare_clean_data(arguments.clean_data)
+        print('{} cells: {:.2f}s one cell at a time, {:.2f}s by column '
+              '({:.1f}x)'.format(arguments.clean_data * 7, by_cell,
+                                 by_column, by_cell / by_column))
+        sys.exit(0)
+
+    benchmark_results = run_benchmarks(arguments.sizes, arguments.functions,
+                                       arguments.forms, arguments.min_seconds)
+    _report(benchmark_results)
+    if arguments.output:
+        with open(arguments.output, 'w') as output_file:
+            json.dump({'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'time': time.time(),
+                       'results': benchmark_results}, output_file, indent=2)
+
+    if arguments.compare:
+        with open(arguments.compare) as baseline_file:
+            baseline_results = json.load(baseline_file)['results']
+        found = find_regressions(baseline_results, benchmark_results,
+                                 arguments.threshold)
+        for regression in found:
+            print('REGRESSION: {function} ({form}, {size} stations) '
+                  '{baseline_ops_per_second:.1f} -> {ops_per_second:.1f} '
+                  'ops/s ({change:+.1%})'.format(**regression))
+        if found:
+            sys.exit(1)
@@ -11,8 +11,12 @@ Copyright (c) 2020 Mario Badr, Jennifer Campbell, Tom Fairgrieve,
 Diane Horton, Michael Liut, Jacqueline Smith, and Anya Tafliovich.
 """
 
+import csv
+import itertools
 import math
-from typing import List, TextIO, Dict
+import operator
+from array import array
+from typing import Iterable, Iterator, List, TextIO, Dict, Union
 
 """For simplicity, we'll use "Station" in our type contracts to indicate that
 we mean a list containing station data. 
@@ -22,6 +26,9 @@ List[int, str, float, float, int, int, int, bool, bool]
 
 where the values at each index represent the station data as described in the 
 handout on Quercus.
+
+A StationTable (see below) stores the same data column by column, and can be
+used anywhere a List["Station"] is expected.
 """
 
 
@@ -38,6 +45,30 @@ NO_KIOSK = 'SMART'
 # For use in a helper function
 EARTH_RADIUS = 6371
 
+# The column of stations.csv holding each item of station data.
+CSV_COLUMNS = {ID: 'station_id', NAME: 'name', LATITUDE: 'lat',
+               LONGITUDE: 'lon', CAPACITY: 'capacity',
+               BIKES_AVAILABLE: 'num_bikes_available',
+               DOCKS_AVAILABLE: 'num_docks_available'}
+
+# The array typecode used to store each column of a StationTable. Names are
+# not numbers, so the NAME column is a plain list.
+COLUMN_TYPECODES = {ID: 'i', LATITUDE: 'd', LONGITUDE: 'd', CAPACITY: 'i',
+                    BIKES_AVAILABLE: 'i', DOCKS_AVAILABLE: 'i'}
+
+# The number of stations StationTable.extend adds to its columns at a time.
+TABLE_BATCH_SIZE = 4096
+
+# A value below every count, used for the unused leaves of a ThresholdIndex.
+NO_VALUE = -2 ** 31
+
+# A ThresholdIndex query expected to match more than one row in this many
+# scans the rows in order instead, which is faster for so many matches.
+SCAN_FRACTION = 16
+
+# The number of rows clean_data looks at to tell which columns hold numbers.
+CLEAN_SAMPLE_ROWS = 16
+
 ### SAMPLE DATA TO USE IN DOCSTRING EXAMPLES ####
 
 SAMPLE_STATIONS = [
@@ -123,13 +154,672 @@ def csv_to_list(csv_file: TextIO) -> List[List[str]]:
     return data
 
 
+def _to_int(value: str) -> int:
+    """Return the whole number that value represents, which may be written
+    with a fractional part of zero.
+
+    >>> _to_int('15')
+    15
+    >>> _to_int('15.0')
+    15
+    """
+
+    try:
+        return int(value)
+    except ValueError:
+        return int(float(value))
+
+
+# The type of each item of station data in stations.csv.
+STATION_SCHEMA = {ID: int, NAME: str, LATITUDE: float, LONGITUDE: float,
+                  CAPACITY: int, BIKES_AVAILABLE: int, DOCKS_AVAILABLE: int}
+
+
+def csv_positions(header: List[str]) -> List[int]:
+    """Return the position in a line of a stations CSV file with header line
+    header of each item of station data, in "Station" index order. If header
+    does not name every column in CSV_COLUMNS, the columns are taken to be
+    in "Station" index order. Columns not named in CSV_COLUMNS are ignored.
+
+    Together with convert_column, this reads a stations CSV file a column
+    at a time, as read_station_table does.
+
+    >>> csv_positions(['station_id', 'name', 'lat', 'lon', 'capacity', \
+    'num_bikes_available', 'num_docks_available'])
+    [0, 1, 2, 3, 4, 5, 6]
+    >>> csv_positions(['name', 'station_id', 'lat', 'lon', 'capacity', \
+    'num_docks_available', 'num_bikes_available'])
+    [1, 0, 2, 3, 4, 6, 5]
+    """
+
+    header = [name.strip() for name in header]
+    if not all(name in header for name in CSV_COLUMNS.values()):
+        return list(range(len(CSV_COLUMNS)))
+    return [header.index(CSV_COLUMNS[index])
+            for index in range(len(CSV_COLUMNS))]
+
+
+def convert_column(values: List[str], kind: type) -> list:
+    """Return a list of the strings in values converted to kind, one of the
+    types in STATION_SCHEMA. For int, whole numbers written like '15.0' are
+    accepted too. Raise ValueError if a value cannot be converted.
+
+    >>> convert_column(['1', '2.0'], int)
+    [1, 2]
+    >>> convert_column(['43.639832'], float)
+    [43.639832]
+    """
+
+    try:
+        return list(map(kind, values))
+    except ValueError:
+        if kind is not int:
+            raise
+        # Only whole numbers written like '15.0' need the slower path.
+        return list(map(_to_int, values))
+
+
+def _clean_value(value: str) -> Union[int, float, str]:
+    """Return value converted as clean_data converts each string: to an int
+    if it represents a whole number, a float if it represents a number that
+    is not a whole number, and unchanged otherwise.
+
+    >>> [_clean_value(value) for value in ['3.0', '+4', '-4.5', '1e5', 'car']]
+    [3, 4, -4.5, '1e5', 'car']
+    """
+
+    if value.lstrip('-+').replace('.', '', 1).isnumeric():
+        number = float(value)
+        if number.is_integer():
+            return int(number)
+        return number
+    return value
+
+
+def _clean_column(values: List[str], numbers: bool = True) -> list:
+    """Return a list of the strings in values converted as _clean_value
+    converts each string. numbers tells whether values is expected to hold
+    only numbers.
+
+    A column expected to hold only numbers is converted with int, or
+    failing that with float, in one pass, if every value is written with
+    only digits, signs and decimal points. Otherwise, or if that fails, each
+    value is checked on its own, and only the numbers are converted.
+
+    >>> _clean_column(['1', '+2', '-3'])
+    [1, 2, -3]
+    >>> _clean_column(['1', '2.0', '-3.5', '.5'])
+    [1, 2, -3.5, 0.5]
+    >>> _clean_column(['1', '1_000', ' 2', '1.2.3'])
+    [1, '1_000', ' 2', '1.2.3']
+    >>> _clean_column(['car', '7'], False)
+    ['car', 7]
+    """
+
+    # int and float also accept spaces, underscores, exponents, 'inf' and
+    # 'nan', none of which clean_data treats as numbers.
+    digits = ''.join(values).replace('+', '').replace('-', '') \
+        if numbers else ''
+    if digits.replace('.', '').isdigit():
+        try:
+            return list(map(int, values))
+        except ValueError:
+            pass
+        try:
+            converted = list(map(float, values))
+        except ValueError:
+            pass
+        else:
+            if not any(map(float.is_integer, converted)):
+                return converted
+            return [int(number) if number.is_integer() else number
+                    for number in converted]
+    # The test in _clean_value, made for every value without a call.
+    unsigned = map(operator.methodcaller('lstrip', '-+'), values)
+    found = map(str.isnumeric,
+                map(operator.methodcaller('replace', '.', '', 1), unsigned))
+    return [_clean_value(value) if number else value
+            for value, number in zip(values, found)]
+
+
+def read_stations(csv_file: TextIO) -> Iterator["Station"]:
+    """Return an iterator over the stations in the open CSV file csv_file,
+    reading one line at a time and converting each value to the type given
+    by STATION_SCHEMA. The columns are found by their names in the header
+    line (see CSV_COLUMNS). Names that contain commas may be quoted.
+
+    This replaces csv_to_list followed by clean_data. To load the stations
+    into a StationTable instead, use read_station_table.
+
+    >>> import io
+    >>> csv_file = io.StringIO('station_id,name,lat,lon,capacity,'
+    ...                        'num_bikes_available,num_docks_available\\n'
+    ...                        '7000,"Fort York Blvd, Capreol Ct",'
+    ...                        '43.639832,-79.395954,35,15,19\\n')
+    >>> list(read_stations(csv_file))
+    [[7000, 'Fort York Blvd, Capreol Ct', 43.639832, -79.395954, 35, 15, 19]]
+    >>> csv_file = io.StringIO('station_id,name,lat,lon,capacity,'
+    ...                        'num_bikes_available,num_docks_available,'
+    ...                        'is_renting\\n'
+    ...                        '7000,Fort York Blvd,'
+    ...                        '43.639832,-79.395954,35.0,15,19,1\\n')
+    >>> list(read_stations(csv_file))
+    [[7000, 'Fort York Blvd', 43.639832, -79.395954, 35, 15, 19]]
+    """
+
+    reader = csv.reader(csv_file)
+    positions = csv_positions(next(reader, []))
+    in_order = positions == list(range(len(positions)))
+
+    for line in reader:
+        if not line:
+            continue
+        if not in_order:
+            line = [line[position] for position in positions]
+        try:
+            yield [int(line[ID]), line[NAME], float(line[LATITUDE]),
+                   float(line[LONGITUDE]), int(line[CAPACITY]),
+                   int(line[BIKES_AVAILABLE]), int(line[DOCKS_AVAILABLE])]
+        except ValueError:
+            # Only the columns of a station are converted; any extra
+            # columns after them are ignored, as in the fast path.
+            yield [convert_column([line[index]], kind)[0]
+                   for index, kind in STATION_SCHEMA.items()]
+
+
 ####### END HELPER FUNCTIONS ####################
 
+
+####### BEGIN STATION TABLE ####################
+
+class StationRow:
+    """A view of one station in a StationTable, indexed with the same
+    constants as a "Station" list. Assigning to an item of the view updates
+    the table.
+    """
+
+    def __init__(self, table: 'StationTable', row: int) -> None:
+        """Initialize a view of the station at index row in table."""
+
+        self._table = table
+        self._columns = table.columns
+        self._row = row
+
+    def __getitem__(self, index: Union[int, slice]) -> object:
+        """Return the value at index of this station, or a list of values if
+        index is a slice.
+        """
+
+        if isinstance(index, slice):
+            return list(self)[index]
+        return self._columns[index][self._row]
+
+    def __setitem__(self, index: int, value: object) -> None:
+        """Set the value at index of this station to value."""
+
+        self._table.set_value(self._row, index, value)
+
+    def __len__(self) -> int:
+        """Return the number of values stored for this station."""
+
+        return len(self._columns)
+
+    def __iter__(self) -> Iterator[object]:
+        """Return an iterator over the values of this station."""
+
+        row = self._row
+        return (column[row] for column in self._columns)
+
+    def __eq__(self, other: object) -> bool:
+        """Return True if and only if other holds the same values as this
+        station, whether other is a StationRow or a "Station" list.
+        """
+
+        if not isinstance(other, (StationRow, list)):
+            return NotImplemented
+        return list(self) == list(other)
+
+    def __repr__(self) -> str:
+        """Return a representation of this station as a "Station" list."""
+
+        return repr(list(self))
+
+
+class ThresholdIndex:
+    """An index of one int column of a StationTable that finds the rows
+    holding at least a given value.
+
+    The index is a tree over the rows in which each node holds the largest
+    value below it, so a query only visits the branches that lead to
+    matching rows, and changing one value only updates the nodes above it.
+    The index also counts the rows holding each value, so that queries that
+    match a large part of the rows can scan them instead.
+
+    >>> index = ThresholdIndex([10, 12, 5])
+    >>> index.at_least(10)
+    [0, 1]
+    >>> index.set(2, 11)
+    >>> index.at_least(11)
+    [1, 2]
+    """
+
+    def __init__(self, values: List[int]) -> None:
+        """Initialize an index of the column values."""
+
+        self._build(values)
+
+    def _build(self, values: List[int]) -> None:
+        """Build this index afresh from the column values."""
+
+        self._count = len(values)
+        self._size = 1
+        while self._size < self._count:
+            self._size *= 2
+        tree = array('i', [NO_VALUE]) * (2 * self._size)
+        tree[self._size:self._size + self._count] = array('i', values)
+        for node in range(self._size - 1, 0, -1):
+            tree[node] = max(tree[2 * node], tree[2 * node + 1])
+        self._tree = tree
+        self._counts = {}
+        for value in values:
+            self._counts[value] = self._counts.get(value, 0) + 1
+
+    def __len__(self) -> int:
+        """Return the number of rows in this index."""
+
+        return self._count
+
+    def set(self, row: int, value: int) -> None:
+        """Record that the value in row is now value."""
+
+        tree = self._tree
+        node = self._size + row
+        if tree[node] != NO_VALUE:
+            self._counts[tree[node]] -= 1
+        self._counts[value] = self._counts.get(value, 0) + 1
+        tree[node] = value
+        node //= 2
+        while node:
+            largest = max(tree[2 * node], tree[2 * node + 1])
+            if tree[node] == largest:
+                return
+            tree[node] = largest
+            node //= 2
+
+    def extend(self, values: List[int]) -> None:
+        """Add rows holding values to the end of this index."""
+
+        if self._count + len(values) > self._size:
+            leaves = self._tree[self._size:self._size + self._count]
+            leaves.extend(values)
+            self._build(leaves)
+            return
+        for value in values:
+            self._count += 1
+            self.set(self._count - 1, value)
+
+    def at_least(self, n: int, labels: List[int] = None) -> List[int]:
+        """Return the rows holding a value of at least n, in order. If
+        labels is given, return the label of each of those rows instead,
+        where labels[row] is the label of row.
+        """
+
+        tree = self._tree
+        size = self._size
+        if labels is None:
+            labels = range(self._count)
+        if self._count == 0 or tree[1] < n:
+            return []
+        matches = sum(count for value, count in self._counts.items()
+                      if value >= n)
+        if matches * SCAN_FRACTION > self._count:
+            return [label for label, value in
+                    zip(labels, tree[size:size + self._count]) if value >= n]
+
+        found = []
+        pending = [1]
+        while pending:
+            node = pending.pop()
+            if node >= size:
+                found.append(labels[node - size])
+            else:
+                left = 2 * node
+                if tree[left + 1] >= n:
+                    pending.append(left + 1)
+                if tree[left] >= n:
+                    pending.append(left)
+        return found
+
+
+class StationTable:
+    """A table of station data stored column by column.
+
+    Each numeric column is a typed array, which takes far less memory than a
+    list of Python ints and floats per station. Indexing or iterating over a
+    table gives StationRow views, so a StationTable can be used wherever a
+    List["Station"] is expected, and the functions below work on whole
+    columns when they are given one.
+
+    >>> table = StationTable(SAMPLE_STATIONS)
+    >>> len(table)
+    3
+    >>> table[0]
+    [7090, 'Danforth Ave / Lamb Ave', 43.681991, -79.329455, 15, 4, 10]
+    >>> table[2][BIKES_AVAILABLE]
+    14
+    >>> table.column(CAPACITY)
+    array('i', [15, 24, 19])
+    >>> table.to_list() == SAMPLE_STATIONS
+    True
+    """
+
+    def __init__(self, stations: List["Station"] = ()) -> None:
+        """Initialize a new table containing the data of the stations in
+        stations, in the same order.
+        """
+
+        self.columns = [array(COLUMN_TYPECODES[index])
+                        if index in COLUMN_TYPECODES else []
+                        for index in range(DOCKS_AVAILABLE + 1)]
+        # The row of each station id, so stations can be found by id without
+        # a scan. It is built by the first call to find, and station ids must
+        # not be changed once they are in a table.
+        self._row_of = None
+        # The sum of each int column, built by the first call to total and
+        # then kept up to date as the table changes. Tables whose columns
+        # are shared with others never build it.
+        self._totals = None
+        # A ThresholdIndex of some int columns, each built by the first call
+        # to at_least for that column and then kept up to date until a
+        # station is removed. Shared tables never build them either.
+        self._thresholds = {}
+        self._shared = False
+        self.extend(stations)
+
+    @classmethod
+    def from_columns(cls, columns: list,
+                     shared: bool = False) -> 'StationTable':
+        """Return a new table that uses columns, a list of sequences in
+        "Station" index order, as its storage without copying them.
+
+        The columns may be any sequences that support indexing, such as
+        memoryviews; the table can only grow or shrink if they are arrays or
+        lists. If shared is True, the numbers in the columns may be changed
+        by others, such as another process, so the table never caches its
+        totals.
+
+        >>> table = StationTable.from_columns(
+        ...     [array('i', [7000]), ['Fort York'], array('d', [43.6]),
+        ...      array('d', [-79.3]), array('i', [35]), array('i', [15]),
+        ...      array('i', [20])])
+        >>> table.find(7000)
+        0
+        """
+
+        table = cls()
+        table.columns = columns
+        table._shared = shared
+        return table
+
+    def __len__(self) -> int:
+        """Return the number of stations in this table."""
+
+        return len(self.columns[ID])
+
+    def __getitem__(self, row: int) -> StationRow:
+        """Return a view of the station at index row of this table."""
+
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError('station table index out of range')
+        return StationRow(self, row)
+
+    def __iter__(self) -> Iterator[StationRow]:
+        """Return an iterator over views of the stations in this table."""
+
+        return (StationRow(self, row) for row in range(len(self)))
+
+    def append(self, station: "Station") -> None:
+        """Add the data of station to the end of this table."""
+
+        self.extend_columns([[station[index]]
+                             for index in range(len(self.columns))])
+
+    def extend(self, stations: Iterator["Station"]) -> None:
+        """Add the data of each station in stations to the end of this
+        table, in order. Stations are added in batches, column by column, so
+        stations may be a generator over a very large file.
+        """
+
+        stations = iter(stations)
+        batch = list(itertools.islice(stations, TABLE_BATCH_SIZE))
+        while batch:
+            self.extend_columns(list(zip(*batch))[:len(self.columns)])
+            batch = list(itertools.islice(stations, TABLE_BATCH_SIZE))
+
+    def extend_columns(self, columns: List[list]) -> None:
+        """Add stations to the end of this table, where columns holds the
+        values for each column in "Station" index order, all of the same
+        length.
+        """
+
+        start = len(self)
+        for column, values in zip(self.columns, columns):
+            column.extend(values)
+        if self._row_of is not None:
+            for row, station_id in enumerate(columns[ID], start):
+                self._row_of.setdefault(station_id, row)
+        if self._totals is not None:
+            for index in self._totals:
+                self._totals[index] += sum(columns[index])
+        for index, thresholds in self._thresholds.items():
+            thresholds.extend(columns[index])
+
+    def remove(self, station_id: int) -> bool:
+        """Remove the station with id station_id from this table. Return True
+        if and only if that station was in this table.
+
+        The stations after it move up one row, so views of them made before
+        the removal must not be used afterwards.
+
+        >>> table = StationTable(SAMPLE_STATIONS)
+        >>> table.remove(7486)
+        True
+        >>> table.remove(7486)
+        False
+        >>> table.find(7571)
+        1
+        """
+
+        row = self.find(station_id)
+        if row == -1:
+            return False
+
+        if self._totals is not None:
+            for index in self._totals:
+                self._totals[index] -= self.columns[index][row]
+        for column in self.columns:
+            del column[row]
+        self._row_of = None
+        self._thresholds = {}
+        return True
+
+    def remove_many(self, station_ids: Iterable[int]) -> int:
+        """Remove every station whose id is in station_ids from this table,
+        keeping the order of the rest, and return the number removed. Unlike
+        a call of remove for each station, this makes one pass over the
+        table however many stations are removed.
+
+        >>> table = StationTable(SAMPLE_STATIONS)
+        >>> table.remove_many([7090, 7571, 7000])
+        2
+        >>> table.column(ID)
+        array('i', [7486])
+        """
+
+        removing = set(station_ids)
+        kept = [station_id not in removing
+                for station_id in self.columns[ID]]
+        if all(kept):
+            return 0
+
+        for column in self.columns:
+            remaining = itertools.compress(column, kept)
+            if isinstance(column, array):
+                column[:] = array(column.typecode, remaining)
+            else:
+                column[:] = remaining
+        self._row_of = None
+        self._totals = None
+        self._thresholds = {}
+        return len(kept) - len(self)
+
+    def find(self, station_id: int) -> int:
+        """Return the row of the station with id station_id in this table,
+        or -1 if there is no such station.
+
+        >>> StationTable(SAMPLE_STATIONS).find(7486)
+        1
+        >>> StationTable(SAMPLE_STATIONS).find(7000)
+        -1
+        """
+
+        if self._row_of is None:
+            self._row_of = {}
+            for row, other_id in enumerate(self.columns[ID]):
+                self._row_of.setdefault(other_id, row)
+        return self._row_of.get(station_id, -1)
+
+    def column(self, index: int) -> Union[array, List[str]]:
+        """Return the column of this table given by index. The column is
+        the table's own storage, not a copy, so change values through
+        set_value rather than through the column.
+        """
+
+        return self.columns[index]
+
+    def set_value(self, row: int, index: int, value: object) -> None:
+        """Set the value at index of the station in row of this table to
+        value, keeping the column totals up to date.
+        """
+
+        column = self.columns[index]
+        if self._totals is not None and index in self._totals:
+            self._totals[index] += value - column[row]
+        column[row] = value
+        if index in self._thresholds:
+            self._thresholds[index].set(row, value)
+
+    def at_least(self, index: int, n: int,
+                 labels_index: int = None) -> list:
+        """Return the rows of this table whose value in the int column given
+        by index is at least n, in order. If labels_index is given, return
+        the values of those rows in the column given by labels_index
+        instead.
+
+        After the first call for a column, calls take time proportional to
+        the number of rows returned (times the log of the table size), and
+        set_value keeps the column's index up to date in logarithmic time.
+
+        >>> table = StationTable(SAMPLE_STATIONS)
+        >>> table.at_least(DOCKS_AVAILABLE, 10)
+        [0, 1]
+        >>> table[1][DOCKS_AVAILABLE] = 3
+        >>> table.at_least(DOCKS_AVAILABLE, 10, ID)
+        [7090]
+        """
+
+        column = self.columns[index]
+        labels = None if labels_index is None else self.columns[labels_index]
+        if self._shared:
+            if labels is None:
+                labels = range(len(column))
+            return [label for label, value in zip(labels, column)
+                    if value >= n]
+        if index not in self._thresholds:
+            self._thresholds[index] = ThresholdIndex(column)
+        return self._thresholds[index].at_least(n, labels)
+
+    def total(self, index: int) -> int:
+        """Return the sum of the int column of this table given by index.
+        After the first call the totals are maintained as the table changes,
+        so later calls take constant time, unless the table is shared.
+
+        >>> table = StationTable(SAMPLE_STATIONS)
+        >>> table.total(BIKES_AVAILABLE)
+        23
+        >>> table[0][BIKES_AVAILABLE] = 0
+        >>> table.total(BIKES_AVAILABLE)
+        19
+        >>> table.append(HANDOUT_STATIONS[0])
+        >>> table.total(BIKES_AVAILABLE)
+        39
+        """
+
+        if self._shared:
+            return sum(self.columns[index])
+        if self._totals is None:
+            self._totals = {column: sum(self.columns[column])
+                            for column in COLUMN_TYPECODES
+                            if COLUMN_TYPECODES[column] == 'i'}
+        return self._totals[index]
+
+    def to_list(self) -> List["Station"]:
+        """Return the stations in this table as a list of "Station" lists."""
+
+        return [list(station) for station in zip(*self.columns)]
+
+
+def read_station_table(csv_file: TextIO) -> StationTable:
+    """Return a StationTable of the stations in the open CSV file csv_file,
+    which is read as described in read_stations.
+
+    The file is read in batches of lines, and each batch is converted one
+    column at a time straight into the table's columns, so no list is made
+    for each station.
+
+    >>> import io
+    >>> csv_file = io.StringIO('station_id,name,lat,lon,capacity,'
+    ...                        'num_bikes_available,num_docks_available\\n'
+    ...                        '7000,"Fort York Blvd, Capreol Ct",'
+    ...                        '43.639832,-79.395954,35,15,19\\n')
+    >>> read_station_table(csv_file).to_list()
+    [[7000, 'Fort York Blvd, Capreol Ct', 43.639832, -79.395954, 35, 15, 19]]
+    >>> csv_file = io.StringIO('station_id,name,lat,lon,capacity,'
+    ...                        'num_bikes_available,num_docks_available,'
+    ...                        'is_renting\\n'
+    ...                        '7000,Fort York Blvd,'
+    ...                        '43.639832,-79.395954,35.0,15,19,1\\n')
+    >>> read_station_table(csv_file).to_list()
+    [[7000, 'Fort York Blvd', 43.639832, -79.395954, 35, 15, 19]]
+    """
+
+    reader = csv.reader(csv_file)
+    positions = csv_positions(next(reader, []))
+    table = StationTable()
+    batch = list(itertools.islice(reader, TABLE_BATCH_SIZE))
+    while batch:
+        lines = list(zip(*[line for line in batch if line]))
+        if lines:
+            table.extend_columns(
+                [convert_column(lines[position], STATION_SCHEMA[index])
+                 for index, position in enumerate(positions)])
+        batch = list(itertools.islice(reader, TABLE_BATCH_SIZE))
+    return table
+
+
+####### END STATION TABLE ####################
+
 def clean_data(data: List[list]) -> None:
     """Convert each string in data to an int if and only if it represents a
     whole number, and a float if and only if it represents a number that is not 
     a whole number.
 
+    The type of each column is guessed from its first CLEAN_SAMPLE_ROWS
+    rows, and a column of numbers is converted all at once (see
+    _clean_column). Rows of different lengths are converted one at a time.
+
     >>> d = [['abc', '123', '45.6', 'car', 'Bike']]
     >>> clean_data(d)
     >>> d
@@ -138,21 +828,31 @@ def clean_data(data: List[list]) -> None:
     >>> clean_data(d)
     >>> d
     [['ab2'], [-123], ['BIKES', 3.2], [3, 4, -5]]
+    >>> d = [['0', '10', '0.0']]
+    >>> clean_data(d)
+    >>> d
+    [[0, 10, 0]]
     """
-    
-   
-    for info_list in data:
-        for i in range(len(info_list)):
-            if info_list[i].lstrip('-+').replace('.', '', 1).isnumeric():
-                if info_list[i].lstrip('-+').rstrip('.0').isdigit():
-                    info_list[i] = int(float(info_list[i]))   
-                else:
-                    info_list[i] = float(info_list[i])
-                
-                
-       
-   
-                
+
+    if not data:
+        return
+    widths = set(map(len, data))
+    if len(widths) > 1:
+        for info_list in data:
+            info_list[:] = map(_clean_value, info_list)
+        return
+
+    sample = data[:CLEAN_SAMPLE_ROWS]
+    columns = []
+    for column in range(widths.pop()):
+        values = list(map(operator.itemgetter(column), data))
+        columns.append(_clean_column(values, all(
+            isinstance(_clean_value(info_list[column]), (int, float))
+            for info_list in sample)))
+    for info_list, cleaned in zip(data, zip(*columns)):
+        info_list[:] = cleaned
+
+
 def has_kiosk(station: "Station") -> bool:
     """Return True if and only if the given station has a kiosk.    
     
@@ -163,7 +863,33 @@ def has_kiosk(station: "Station") -> bool:
     """
     
     return not NO_KIOSK in station[NAME]
-                
+
+
+def find_station(station_id: int, stations: List["Station"]) -> "Station":
+    """Return the first station in stations with id station_id, or None if
+    there is no such station. Stations in a StationTable are found by id
+    without scanning the table.
+
+    >>> find_station(7486, SAMPLE_STATIONS)[NAME]
+    'Gerrard St E / Ted Reeve Dr'
+    >>> find_station(7486, StationTable(SAMPLE_STATIONS))[NAME]
+    'Gerrard St E / Ted Reeve Dr'
+    >>> find_station(7000, SAMPLE_STATIONS) is None
+    True
+    """
+
+    if isinstance(stations, StationTable):
+        row = stations.find(station_id)
+        if row == -1:
+            return None
+        return stations[row]
+
+    for station in stations:
+        if station[ID] == station_id:
+            return station
+    return None
+
+
 def get_station_info(station_id: int, stations: List["Station"]) -> list:
     """Return a list containing the following information from stations
     about the station with id number station_id:
@@ -181,19 +907,11 @@ def get_station_info(station_id: int, stations: List["Station"]) -> list:
     ['Highfield Rd / Gerrard St E - SMART', 14, 5, False]
     """
     
-    station_info = []
-    
-    for station in stations:
-            if station_id in station:
-                station_info.append(station[NAME])
-                station_info.append(station[BIKES_AVAILABLE])
-                station_info.append(station[DOCKS_AVAILABLE])
-                if not NO_KIOSK in station[NAME]:
-                    station_info.append(True)
-                else:
-                    station_info.append(False)
-                
-    return station_info
+    station = find_station(station_id, stations)
+    if station is None:
+        return []
+    return [station[NAME], station[BIKES_AVAILABLE], station[DOCKS_AVAILABLE],
+            has_kiosk(station)]
     
 
 def get_total(index: int, stations: List["Station"]) -> int:
@@ -206,8 +924,13 @@ def get_total(index: int, stations: List["Station"]) -> int:
     23
     >>> get_total(DOCKS_AVAILABLE, SAMPLE_STATIONS)
     34
+    >>> get_total(CAPACITY, StationTable(SAMPLE_STATIONS))
+    58
     """
     
+    if isinstance(stations, StationTable):
+        return stations.total(index)
+
     column = []
     for station in stations:
         column.append(station[index])
@@ -225,14 +948,37 @@ def get_stations_with_n_docks(n: int, stations: List["Station"]) -> List[int]:
     [7090, 7486, 7571]
     >>> get_stations_with_n_docks(12, SAMPLE_STATIONS)
     [7486]
+    >>> get_stations_with_n_docks(10, StationTable(SAMPLE_STATIONS))
+    [7090, 7486]
     """
+    if isinstance(stations, StationTable):
+        return stations.at_least(DOCKS_AVAILABLE, n, ID)
+
     available_id = []
     for station in stations:
         if station[DOCKS_AVAILABLE] >= n:
             available_id.append(station[ID])
     return available_id
-            
-    
+
+
+def get_stations_with_n_bikes(n: int, stations: List["Station"]) -> List[int]:
+    """Return a list containing the station IDs for the stations in stations
+    that have at least n bikes available, in the same order as they appear
+    in stations.
+
+    Precondition: n >= 0
+
+    >>> get_stations_with_n_bikes(5, SAMPLE_STATIONS)
+    [7486, 7571]
+    >>> get_stations_with_n_bikes(10, StationTable(SAMPLE_STATIONS))
+    [7571]
+    """
+    if isinstance(stations, StationTable):
+        return stations.at_least(BIKES_AVAILABLE, n, ID)
+
+    return [station[ID] for station in stations
+            if station[BIKES_AVAILABLE] >= n]
+
 
 def get_nearest_station(lat: float, lon: float, with_kiosk: bool,
                         stations: List['Station']) -> int:
@@ -253,28 +999,20 @@ def get_nearest_station(lat: float, lon: float, with_kiosk: bool,
     7571
     >>> get_nearest_station(43.674312, -79.299221, True, SAMPLE_STATIONS)
     7486
+    >>> get_nearest_station(43.671134, -79.325164, True, SAMPLE_STATIONS)
+    7090
     """
     
-    distance_list = []
-    
+    nearest_id = stations[0][ID]
+    min_distance = -1
     for station in stations:
-        if stations[with_kiosk] is True:
-            if NO_KIOSK in stations[NAME]:
-                distance_list.append(get_lat_lon_distance(station[LATITUDE],
-                                                          station[LONGITUDE]
-                                                          , lat, lon))
-        else:
-            distance_list.append(get_lat_lon_distance(station[LATITUDE], \
-                                                      station[LONGITUDE]
-                                                      , lat, lon))
-    
-    min_distance_index = 0
-    min_distance = distance_list[0]
-    for i in range(len(distance_list)):
-        if distance_list[i] < min_distance:
-            min_distance_index = i
-            min_distance = distance_list[i]
-    return stations[min_distance_index][ID]    
+        if not with_kiosk or has_kiosk(station):
+            distance = get_lat_lon_distance(station[LATITUDE],
+                                            station[LONGITUDE], lat, lon)
+            if min_distance == -1 or distance < min_distance:
+                nearest_id = station[ID]
+                min_distance = distance
+    return nearest_id
         
         
 def rent_bike(station_id: int, stations: List["Station"]) -> bool:
@@ -305,18 +1043,21 @@ def rent_bike(station_id: int, stations: List["Station"]) -> bool:
     True
     >>> original_docks_available == no_bike_station[DOCKS_AVAILABLE]
     True
+    >>> full_station = [7090, 'Danforth Ave / Lamb Ave', \
+    43.681991, -79.329455, 15, 15, 0]
+    >>> rent_bike(7090, StationTable([full_station]))
+    True
     """
 
-    for station in stations:
-        if station_id == station[ID]:
-            if station[BIKES_AVAILABLE] > 0 and station[DOCKS_AVAILABLE] > 0:
-                station[BIKES_AVAILABLE] = station[BIKES_AVAILABLE] - 1 
-                station[DOCKS_AVAILABLE] = station[DOCKS_AVAILABLE] + 1 
-                return True
-            else: 
-                return False
-    else:
-        return None
+    station = find_station(station_id, stations)
+    if station is None or station[BIKES_AVAILABLE] <= 0:
+        return False
+
+    station[BIKES_AVAILABLE] = station[BIKES_AVAILABLE] - 1
+    station[DOCKS_AVAILABLE] = station[DOCKS_AVAILABLE] + 1
+    return True
+
+
 def return_bike(station_id: int, stations: List["Station"]) -> bool:
     """Update the available bike count and the docks available count
     for station in stations with id station_id as if a single bike was added,
@@ -345,18 +1086,21 @@ def return_bike(station_id: int, stations: List["Station"]) -> bool:
     True
     >>> original_docks_available == no_dock_station[DOCKS_AVAILABLE]
     True
+    >>> empty_station = [7090, 'Danforth Ave / Lamb Ave', \
+    43.681991, -79.329455, 15, 0, 15]
+    >>> return_bike(7090, StationTable([empty_station]))
+    True
     """
 
-    for station in stations:
-        if station_id == station[ID]:
-            if station[BIKES_AVAILABLE] > 0 and station[DOCKS_AVAILABLE] > 0:
-                station[BIKES_AVAILABLE] = station[BIKES_AVAILABLE] + 1 
-                station[DOCKS_AVAILABLE] = station[DOCKS_AVAILABLE] - 1 
-                return True
-            else: 
-                return False
-    else:
-        return None            
+    station = find_station(station_id, stations)
+    if station is None or station[DOCKS_AVAILABLE] <= 0:
+        return False
+
+    station[BIKES_AVAILABLE] = station[BIKES_AVAILABLE] + 1
+    station[DOCKS_AVAILABLE] = station[DOCKS_AVAILABLE] - 1
+    return True
+
+
 def redistribute_bikes(stations: List["Station"]) -> int:
     """Calculate the percentage of bikes available across all stations
     and evenly distribute the bikes so that each station has as close to the
@@ -384,20 +1128,63 @@ def redistribute_bikes(stations: List["Station"]) -> int:
     [7571, 'Highfield Rd / Gerrard St E - SMART', 43.671685, -79.325176, \
     19, 8, 11]]
     True
+    >>> sample_table = StationTable(SAMPLE_STATIONS)
+    >>> redistribute_bikes(sample_table)
+    -1
+    >>> sample_table.to_list() == sample_copy
+    True
     """
     
+    difference = 0
+    for row, change in _redistribution_changes(stations):
+        station = stations[row]
+        station[DOCKS_AVAILABLE] = station[DOCKS_AVAILABLE] - change
+        station[BIKES_AVAILABLE] = station[BIKES_AVAILABLE] + change
+        difference -= change
+    return difference
+
+
+def plan_redistribution(stations: List["Station"]) -> List[List[int]]:
+    """Return the moves redistribute_bikes would make to stations, without
+    making them, as a list of [station id, change in bikes available] pairs
+    in the same order as stations. Stations that would not change are left
+    out. A positive change means bikes are returned to the station, and a
+    negative change means bikes are rented from it.
+
+    On a StationTable the bike and capacity totals are maintained as bikes
+    are rented and returned, so this only takes a single pass over the
+    bikes and capacity columns.
+
+    >>> plan_redistribution(SAMPLE_STATIONS)
+    [[7090, 2], [7486, 5], [7571, -6]]
+    >>> plan_redistribution(StationTable(HANDOUT_STATIONS))
+    [[7000, -3], [7001, 3]]
+    """
+
+    return [[stations[row][ID], change]
+            for row, change in _redistribution_changes(stations)]
+
+
+def _redistribution_changes(stations: List["Station"]) -> List[List[int]]:
+    """Return a list of [row, change in bikes available] pairs for each
+    station in stations that redistribute_bikes would change.
+    """
+
     percentage = (get_total(BIKES_AVAILABLE, stations) /
                   get_total(CAPACITY, stations))
-    sum = 0
-    for station in stations:
-        total = station[BIKES_AVAILABLE] + station[DOCKS_AVAILABLE]
-        value_1 = station[BIKES_AVAILABLE]
-        distrubuted_bikes = round(station[CAPACITY] * percentage)
-        station[BIKES_AVAILABLE] = distrubuted_bikes
-        station[DOCKS_AVAILABLE] = total - distrubuted_bikes
-
-        sum += (value_1 - distrubuted_bikes)
-    return sum
+    if isinstance(stations, StationTable):
+        bikes = stations.column(BIKES_AVAILABLE)
+        capacities = stations.column(CAPACITY)
+    else:
+        bikes = [station[BIKES_AVAILABLE] for station in stations]
+        capacities = [station[CAPACITY] for station in stations]
+
+    changes = []
+    for row, capacity in enumerate(capacities):
+        change = round(capacity * percentage) - bikes[row]
+        if change != 0:
+            changes.append([row, change])
+    return changes
     
     
 if __name__ == '__main__':
@@ -406,9 +1193,8 @@ if __name__ == '__main__':
     # To test your code with larger lists, you can uncomment the code below to
     # read data from the provided CSV file.
     # stations_file = open('stations.csv')
-    # bike_stations = csv_to_list(stations_file)
+    # bike_stations = list(read_stations(stations_file))
     # stations_file.close()
-    # clean_data(bike_stations)
     # print(bike_stations[:2])
 
     # For example,
@@ -422,12 +1208,29 @@ def func3(lst: List[int]) -> bool:
         i = i + 1
     return False
 def do_search(data: Dict[str, List[str]], start: str, steps: int) -> List[str]:
-    result = [start]
-    new_result = []
+    """Return the items that can be reached from start in data, which maps
+    each item to the items it leads to, in from 1 to steps steps, in the
+    order they are first reached. Return [start] if steps is 0.
+
+    For graphs of stations, see the station_graph module.
+
+    >>> data = {'a': ['b', 'c'], 'b': ['c', 'd'], 'c': ['a'], 'd': []}
+    >>> do_search(data, 'a', 1)
+    ['b', 'c']
+    >>> do_search(data, 'a', 2)
+    ['b', 'c', 'd', 'a']
+    """
+
+    if steps == 0:
+        return [start]
+    reached = {}
+    frontier = [start]
     for step in range(steps):
-        for user in result:
+        found = []
+        for user in frontier:
             for item in data[user]:
-                if item not in new_result:
-                    new_result.append(item)
-        result = new_result[:]
-    return result 
\ No newline at end of file
+                if item not in reached:
+                    reached[item] = True
+                    found.append(item)
+        frontier = found
+    return list(reached)
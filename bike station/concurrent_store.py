@@ -0,0 +1,206 @@
+"""A station store that can be shared between threads.
+
+The functions in bikes change stations without any synchronization, so they
+cannot be called from several threads at once. A ConcurrentStationStore
+guards its stations with a fixed number of striped locks: each station is
+guarded by one lock, and each lock guards every STRIPES-th station, so
+rentals and returns at different stations rarely wait for each other.
+
+Run this module to stress test a store from many threads.
+"""
+
+import random
+import threading
+from typing import List
+
+from bikes import (ID, BIKES_AVAILABLE, DOCKS_AVAILABLE, SAMPLE_STATIONS,
+                   get_station_info, plan_redistribution, rent_bike,
+                   return_bike)
+
+# The number of locks guarding the stations of a store.
+STRIPES = 64
+
+
+class ConcurrentStationStore:
+    """A thread-safe store of stations.
+
+    The store keeps its own copy of the stations it is given. Every method
+    may be called from any thread.
+
+    >>> store = ConcurrentStationStore(SAMPLE_STATIONS)
+    >>> store.rent_bike(7090)
+    True
+    >>> store.get_station_info(7090)
+    ['Danforth Ave / Lamb Ave', 3, 11, True]
+    >>> store.redistribute_bikes()
+    0
+    """
+
+    def __init__(self, stations: List["Station"],
+                 stripes: int = STRIPES) -> None:
+        """Initialize a new store with a copy of the stations in stations,
+        guarded by stripes locks.
+        """
+
+        self._stations = [list(station) for station in stations]
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self._by_id = {}
+        self._lock_of = {}
+        for row, station in enumerate(self._stations):
+            if station[ID] not in self._by_id:
+                self._by_id[station[ID]] = station
+                self._lock_of[station[ID]] = self._locks[row % stripes]
+
+    def rent_bike(self, station_id: int) -> bool:
+        """Rent a bike from the station with id station_id, as rent_bike
+        does, and return True if and only if the rental was successful.
+        """
+
+        if station_id not in self._by_id:
+            return False
+        with self._lock_of[station_id]:
+            return rent_bike(station_id, [self._by_id[station_id]])
+
+    def return_bike(self, station_id: int) -> bool:
+        """Return a bike to the station with id station_id, as return_bike
+        does, and return True if and only if the return was successful.
+        """
+
+        if station_id not in self._by_id:
+            return False
+        with self._lock_of[station_id]:
+            return return_bike(station_id, [self._by_id[station_id]])
+
+    def get_station_info(self, station_id: int) -> list:
+        """Return the information get_station_info gives about the station
+        with id station_id.
+        """
+
+        if station_id not in self._by_id:
+            return []
+        with self._lock_of[station_id]:
+            return get_station_info(station_id, [self._by_id[station_id]])
+
+    def snapshot(self) -> List["Station"]:
+        """Return a copy of the stations in this store.
+
+        Each station is copied while holding its lock, so every station in
+        the copy is in a state it was really in, but only one lock is held
+        at a time, so rentals and returns carry on during the copy.
+        """
+
+        copies = [None] * len(self._stations)
+        for stripe, lock in enumerate(self._locks):
+            with lock:
+                for row in range(stripe, len(self._stations),
+                                 len(self._locks)):
+                    copies[row] = self._stations[row][:]
+        return copies
+
+    def redistribute_bikes(self) -> int:
+        """Redistribute the bikes in this store as redistribute_bikes does,
+        and return the difference between the number of bikes rented and
+        the number of bikes returned.
+
+        The target number of bikes at each station is planned from a
+        snapshot. Each station is then set to its target while holding only
+        its own lock. Rentals and returns made in the meantime keep the
+        station's total of bikes and docks the same, so that total is still
+        respected.
+        """
+
+        snapshot = self.snapshot()
+        targets = {station[ID]: station[BIKES_AVAILABLE] for station in
+                   snapshot}
+        for station_id, change in plan_redistribution(snapshot):
+            targets[station_id] += change
+
+        difference = 0
+        for station_id, target in targets.items():
+            if station_id not in self._by_id:
+                continue
+            station = self._by_id[station_id]
+            with self._lock_of[station_id]:
+                change = target - station[BIKES_AVAILABLE]
+                station[BIKES_AVAILABLE] = target
+                station[DOCKS_AVAILABLE] = station[DOCKS_AVAILABLE] - change
+            difference -= change
+        return difference
+
+
+def stress_test(stations: List["Station"], threads: int = 8,
+                operations: int = 10000, seed: int = 0) -> bool:
+    """Return True if and only if a ConcurrentStationStore of stations keeps
+    its invariants while threads threads each make operations random
+    rentals and returns, one more thread redistributes bikes over and over,
+    and another takes snapshots over and over.
+
+    The invariants are that no station ever has a negative number of bikes
+    or docks, and that the number of bikes plus docks at each station never
+    changes. At the end, the total number of bikes must also match the
+    successful rentals, returns and redistributions.
+
+    >>> stress_test(SAMPLE_STATIONS, threads=4, operations=2000)
+    True
+    """
+
+    store = ConcurrentStationStore(stations)
+    sizes = {station[ID]: station[BIKES_AVAILABLE] + station[DOCKS_AVAILABLE]
+             for station in stations}
+    station_ids = list(sizes)
+    initial_bikes = sum(station[BIKES_AVAILABLE] for station in stations)
+    changes = []
+    failures = []
+    done = threading.Event()
+
+    def trade(worker: int) -> None:
+        """Make random rentals and returns, recording the net change."""
+
+        generator = random.Random(seed * threads + worker)
+        change = 0
+        for _ in range(operations):
+            station_id = generator.choice(station_ids)
+            if generator.random() < 0.5:
+                change -= store.rent_bike(station_id)
+            else:
+                change += store.return_bike(station_id)
+        changes.append(change)
+
+    def redistribute() -> None:
+        """Redistribute bikes until the traders are done."""
+
+        while not done.is_set():
+            changes.append(-store.redistribute_bikes())
+
+    def check() -> None:
+        """Check the invariants on snapshots until the traders are done."""
+
+        while not done.is_set():
+            for station in store.snapshot():
+                bikes = station[BIKES_AVAILABLE]
+                docks = station[DOCKS_AVAILABLE]
+                if bikes < 0 or docks < 0 or \
+                        bikes + docks != sizes[station[ID]]:
+                    failures.append(station)
+
+    traders = [threading.Thread(target=trade, args=(worker,))
+               for worker in range(threads)]
+    others = [threading.Thread(target=redistribute),
+              threading.Thread(target=check)]
+    for thread in traders + others:
+        thread.start()
+    for thread in traders:
+        thread.join()
+    done.set()
+    for thread in others:
+        thread.join()
+
+    final_bikes = sum(station[BIKES_AVAILABLE] for station in store.snapshot())
+    return not failures and final_bikes == initial_bikes + sum(changes)
+
+
+if __name__ == '__main__':
+    import synthetic
+
+    print('Stress test passed:', stress_test(
+        synthetic.synthetic_stations(2000), threads=16, operations=50000))
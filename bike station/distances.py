@@ -0,0 +1,246 @@
+"""Batch distance queries between locations and bike stations.
+
+These functions give exactly the same rounded distances as calling
+get_lat_lon_distance on each pair, but convert the station coordinates to
+radians (and take their cosines) once for the whole stations list instead
+of once per pair.
+
+For networks too large for a full distance matrix, a DistanceCache keeps
+the rows of the matrix for the stations asked about most, and computes
+other distances as they are needed.
+"""
+
+import collections
+import math
+from array import array
+from typing import Dict, List
+
+from bikes import (ID, LATITUDE, LONGITUDE, EARTH_RADIUS, SAMPLE_STATIONS,
+                   get_lat_lon_distance)
+
+# The most rows of distances a DistanceCache keeps by default.
+CACHE_ROWS = 128
+
+# The number of times a DistanceCache is asked about a station without a
+# cached row before it computes and keeps the row.
+HOT_AFTER = 16
+
+
+class StationCoordinates:
+    """The coordinates of a list of stations, prepared for computing many
+    distances at once. Build one for a stations list and reuse it for as
+    many queries as needed.
+
+    >>> coordinates = StationCoordinates(SAMPLE_STATIONS)
+    >>> coordinates.distances_from(43.671134, -79.325164)
+    [1.256, 2.539, 0.061]
+    """
+
+    def __init__(self, stations: List["Station"]) -> None:
+        """Initialize the coordinates of the stations in stations."""
+
+        self.lats = [math.radians(station[LATITUDE]) for station in stations]
+        self.lons = [math.radians(station[LONGITUDE])
+                     for station in stations]
+        self.cos_lats = [math.cos(lat) for lat in self.lats]
+
+    def __len__(self) -> int:
+        """Return the number of stations these coordinates are for."""
+
+        return len(self.lats)
+
+    def distances_from(self, lat: float, lon: float) -> List[float]:
+        """Return a list of the distances in kilometers from each station to
+        the location (lat, lon), rounded to the nearest metre, in the same
+        order as the stations.
+        """
+
+        lat, lon = math.radians(lat), math.radians(lon)
+        return _distances(lat, lon, math.cos(lat),
+                          self.lats, self.lons, self.cos_lats)
+
+    def distance_matrix(self) -> List[List[float]]:
+        """Return a list of lists where the item at index j of list i is the
+        distance in kilometers between stations i and j, rounded to the
+        nearest metre.
+        """
+
+        lats, lons, cos_lats = self.lats, self.lons, self.cos_lats
+        matrix = []
+        for i in range(len(lats)):
+            # Each distance is the same either way round, so only the
+            # distances to the stations after station i are computed here.
+            row = [matrix[j][i] for j in range(i)]
+            row.extend(_distances(lats[i], lons[i], cos_lats[i],
+                                  lats[i:], lons[i:], cos_lats[i:]))
+            matrix.append(row)
+        return matrix
+
+
+class DistanceCache:
+    """Distances between stations, looked up by station id, with the rows
+    of the distance matrix for recently used stations kept in a bounded
+    least-recently-used cache.
+
+    A distance between two stations is a hit if the row of either station
+    is cached. Otherwise it is a miss and is computed on its own, and once
+    a station has been part of HOT_AFTER misses its whole row is computed
+    and cached, evicting the least recently used row if the cache is full.
+    Rows are stored as 32-bit floats, which hold distances of up to a few
+    thousand kilometers to the metre, and distances are rounded to the
+    metre when read, so they are the same as get_lat_lon_distance gives.
+
+    >>> cache = DistanceCache(SAMPLE_STATIONS, max_rows=1)
+    >>> cache.distance(7090, 7571)
+    1.197
+    >>> round(cache.distances_from(7090)[1], 3)
+    2.435
+    >>> cache.distance(7486, 7090)
+    2.435
+    >>> len(cache.distances_from(7486))
+    3
+    >>> cache.stats()
+    {'hits': 1, 'misses': 3, 'rows_built': 2, 'evictions': 1}
+    """
+
+    def __init__(self, stations: List["Station"],
+                 max_rows: int = CACHE_ROWS) -> None:
+        """Initialize a cache of the distances between the stations in
+        stations, keeping at most max_rows rows.
+
+        Precondition: max_rows > 0
+        """
+
+        self._coordinates = StationCoordinates(stations)
+        self._row_of = {}
+        for row, station in enumerate(stations):
+            self._row_of.setdefault(station[ID], row)
+        self._max_rows = max_rows
+        self._rows = collections.OrderedDict()
+        self._misses = collections.Counter()
+        self.hits = 0
+        self.misses = 0
+        self.rows_built = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        """Return the number of rows in this cache."""
+
+        return len(self._rows)
+
+    def distance(self, station_id: int, other_id: int) -> float:
+        """Return the distance in kilometers between the stations with ids
+        station_id and other_id, rounded to the nearest metre.
+
+        Raise KeyError if either station is not in this cache's stations.
+        """
+
+        row, other_row = self._row_of[station_id], self._row_of[other_id]
+        for cached, column in [(row, other_row), (other_row, row)]:
+            if cached in self._rows:
+                self.hits += 1
+                self._rows.move_to_end(cached)
+                return round(self._rows[cached][column], 3)
+
+        self.misses += 1
+        for hot in [row, other_row]:
+            self._misses[hot] += 1
+            if self._misses[hot] >= HOT_AFTER:
+                self._build(hot)
+        coordinates = self._coordinates
+        return _distances(coordinates.lats[row], coordinates.lons[row],
+                          coordinates.cos_lats[row],
+                          [coordinates.lats[other_row]],
+                          [coordinates.lons[other_row]],
+                          [coordinates.cos_lats[other_row]])[0]
+
+    def distances_from(self, station_id: int) -> array:
+        """Return the distances in kilometers from the station with id
+        station_id to every station, in the same order as the stations, as
+        an array of 32-bit floats; round an item to 3 decimal places to get
+        the distance get_lat_lon_distance gives. The row is cached.
+
+        Raise KeyError if the station is not in this cache's stations.
+        """
+
+        row = self._row_of[station_id]
+        if row in self._rows:
+            self.hits += 1
+            self._rows.move_to_end(row)
+        else:
+            self.misses += 1
+            self._build(row)
+        return self._rows[row]
+
+    def _build(self, row: int) -> None:
+        """Compute and cache the distances from the station in row,
+        evicting the least recently used row if the cache is full.
+        """
+
+        if row in self._rows:
+            return
+        coordinates = self._coordinates
+        self._rows[row] = array('f', _distances(
+            coordinates.lats[row], coordinates.lons[row],
+            coordinates.cos_lats[row], coordinates.lats, coordinates.lons,
+            coordinates.cos_lats))
+        self._misses.pop(row, None)
+        self.rows_built += 1
+        if len(self._rows) > self._max_rows:
+            self._rows.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        """Return a dict of the hits, misses, rows built and evictions of
+        this cache so far.
+        """
+
+        return {'hits': self.hits, 'misses': self.misses,
+                'rows_built': self.rows_built, 'evictions': self.evictions}
+
+
+def _distances(lat: float, lon: float, cos_lat: float, lats: List[float],
+               lons: List[float], cos_lats: List[float]) -> List[float]:
+    """Return the rounded distances in kilometers from each location in
+    lats and lons to the location (lat, lon), where all angles are in
+    radians and cos_lat and cos_lats are the cosines of the latitudes.
+
+    The haversine formula is evaluated exactly as get_lat_lon_distance does,
+    so the results are identical.
+    """
+
+    sin, asin, sqrt = math.sin, math.asin, math.sqrt
+    return [round(2 * asin(sqrt(sin((lat - other_lat) / 2) ** 2
+                                + other_cos * cos_lat
+                                * sin((lon - other_lon) / 2) ** 2))
+                  * EARTH_RADIUS, 3)
+            for other_lat, other_lon, other_cos in zip(lats, lons, cos_lats)]
+
+
+def distances_from(lat: float, lon: float,
+                   stations: List["Station"]) -> List[float]:
+    """Return a list of the distances in kilometers from each station in
+    stations to the location (lat, lon), rounded to the nearest metre, in
+    the same order as stations.
+
+    >>> distances_from(43.671134, -79.325164, SAMPLE_STATIONS)
+    [1.256, 2.539, 0.061]
+    >>> distances_from(43.671134, -79.325164, SAMPLE_STATIONS)[0] == \
+    get_lat_lon_distance(SAMPLE_STATIONS[0][LATITUDE], \
+                         SAMPLE_STATIONS[0][LONGITUDE], 43.671134, -79.325164)
+    True
+    """
+
+    return StationCoordinates(stations).distances_from(lat, lon)
+
+
+def distance_matrix(stations: List["Station"]) -> List[List[float]]:
+    """Return a list of lists where the item at index j of list i is the
+    distance in kilometers between stations[i] and stations[j], rounded to
+    the nearest metre.
+
+    >>> distance_matrix(SAMPLE_STATIONS)
+    [[0.0, 2.435, 1.197], [2.435, 0.0, 2.505], [1.197, 2.505, 0.0]]
+    """
+
+    return StationCoordinates(stations).distance_matrix()
@@ -0,0 +1,373 @@
+"""Forecasts of demand at each station from a history of snapshots.
+
+A history is a CSV file in the layout of stations.csv with one more column,
+TIMESTAMP_COLUMN, holding the time of the snapshot each line belongs to in
+ISO 8601 format (such as 2020-09-01T08:05:00). The lines of each snapshot
+must be together, and snapshots must be in time order.
+
+A DemandModel reads a history one snapshot at a time and adds up, for each
+station and each hour of the week, the bikes rented and returned and the
+hours observed. Only the net change in bikes between two snapshots can be
+seen, so a fall counts as rentals and a rise as returns; the shorter the
+time between snapshots, the closer this is to the true numbers. When a
+snapshot lists the same stations in the same order as the one before, which
+is the usual case, the changes of all stations are added up at once, column
+by column. The model keeps only its totals and the last snapshot, so its
+memory does not grow with the length of the history.
+
+From the rates of rentals and returns at each hour of the week, forecast
+predicts when each station will run out of bikes or docks, so bikes can be
+moved before it happens.
+
+Run this module to build a model from a synthetic week of 5-minute
+snapshots of 1000 stations and list the stations that will soon run out.
+"""
+
+import csv
+import datetime
+import itertools
+import operator
+import random
+from array import array
+from typing import Iterator, List, NamedTuple, TextIO, Tuple
+
+from bikes import (ID, LATITUDE, LONGITUDE, BIKES_AVAILABLE,
+                   DOCKS_AVAILABLE, convert_column, csv_positions)
+
+# The name of the column of a history holding the time of each snapshot.
+TIMESTAMP_COLUMN = 'timestamp'
+
+# The number of hours in a week: one set of totals is kept for each.
+SLOTS = 7 * 24
+
+# Changes between snapshots more than this many hours apart, such as across
+# an outage of the feed, are not counted.
+MAX_GAP_HOURS = 1.0
+
+# The number of hours ahead forecast looks by default.
+HORIZON_HOURS = 24.0
+
+
+class Forecast(NamedTuple):
+    """The forecast for one station: its id, its bikes and docks available
+    in the last snapshot, and the hours from then until it is expected to
+    run out of bikes and of docks, or None if it is not expected to within
+    the horizon of the forecast.
+    """
+
+    station_id: int
+    bikes: int
+    docks: int
+    hours_to_empty: float
+    hours_to_full: float
+
+
+def _slot(moment: datetime.datetime) -> int:
+    """Return the hour of the week of moment, from 0 for midnight to 1 am
+    on Monday to SLOTS - 1 for 11 pm to midnight on Sunday.
+
+    >>> _slot(datetime.datetime(2020, 9, 1, 8, 5))
+    32
+    """
+
+    return moment.weekday() * 24 + moment.hour
+
+
+class DemandModel:
+    """The rentals and returns seen at each station in each hour of the
+    week.
+
+    >>> model = DemandModel()
+    >>> model.add_snapshot(datetime.datetime(2020, 9, 1, 8), [7090, 7486],
+    ...                    [12, 5], [3, 19])
+    >>> model.add_snapshot(datetime.datetime(2020, 9, 1, 8, 30),
+    ...                    [7090, 7486], [9, 7], [6, 17])
+    >>> model.rates(7090)[0][32], model.rates(7486)[1][32]
+    (6.0, 4.0)
+    >>> model.add_snapshot(datetime.datetime(2020, 9, 8, 8), [7090, 7486],
+    ...                    [4, 22], [11, 2])
+    >>> [forecast[3:] for forecast in model.forecast(2.0)]
+    [(0.667, None), (None, 0.5)]
+
+    A station first seen in a snapshot has no changes counted for it until
+    the next one.
+
+    >>> model.add_snapshot(datetime.datetime(2020, 9, 8, 8, 5),
+    ...                    [7090, 7486, 7571], [4, 22, 12], [11, 2, 7])
+    >>> model.rates(7571)[1][32]
+    0.0
+    """
+
+    def __init__(self, max_gap_hours: float = MAX_GAP_HOURS) -> None:
+        """Initialize a model that has seen no snapshots, and that does not
+        count changes between snapshots more than max_gap_hours apart.
+        """
+
+        self.max_gap_hours = max_gap_hours
+        self.snapshots = 0
+        self.last_moment = None
+        # The id of the station in each row of the columns below, in the
+        # order the stations were first seen.
+        self.station_ids = []
+        self._row_of = {}
+        # For each hour of the week, the rentals, returns and hours seen at
+        # the station in each row.
+        self.rentals = [array('d') for _ in range(SLOTS)]
+        self.returns = [array('d') for _ in range(SLOTS)]
+        self.hours = [array('d') for _ in range(SLOTS)]
+        # The bikes and docks available at each station when it was last
+        # seen, and the number of the snapshot it was last seen in.
+        self.bikes = array('i')
+        self.docks = array('i')
+        self._last_seen = array('i')
+        # Whether the last snapshot held every station, in row order.
+        self._complete = False
+
+    def _add_stations(self, station_ids: List[int]) -> None:
+        """Give a row to each station in station_ids that has none yet."""
+
+        new = [station_id for station_id in dict.fromkeys(station_ids)
+               if station_id not in self._row_of]
+        if not new:
+            return
+        for station_id in new:
+            self._row_of[station_id] = len(self.station_ids)
+            self.station_ids.append(station_id)
+        zeros = array('d', bytes(8 * len(new)))
+        for slot in range(SLOTS):
+            self.rentals[slot].extend(zeros)
+            self.returns[slot].extend(zeros)
+            self.hours[slot].extend(zeros)
+        self.bikes.extend(array('i', bytes(4 * len(new))))
+        self.docks.extend(array('i', bytes(4 * len(new))))
+        self._last_seen.extend(array('i', [-1]) * len(new))
+
+    def add_snapshot(self, moment: datetime.datetime, station_ids: List[int],
+                     bikes: List[int], docks: List[int]) -> None:
+        """Add the snapshot taken at moment, in which the station with id
+        station_ids[i] had bikes[i] bikes and docks[i] docks available.
+
+        Precondition: moment is later than the moment of every snapshot
+        added before.
+        """
+
+        known = len(self.station_ids)
+        self._add_stations(station_ids)
+        if self.last_moment is not None:
+            elapsed = (moment - self.last_moment).total_seconds() / 3600
+            if elapsed <= 0:
+                raise ValueError('snapshots must be added in time order')
+            if elapsed <= self.max_gap_hours:
+                slot = _slot(self.last_moment)
+                # Stations added just now were not in the last snapshot,
+                # so only count every row at once if there are none.
+                if (self._complete and known == len(self.station_ids)
+                        and station_ids == self.station_ids):
+                    self._count_all(slot, elapsed, bikes)
+                else:
+                    self._count_each(slot, elapsed, station_ids, bikes,
+                                     known)
+
+        if station_ids == self.station_ids:
+            self.bikes = array('i', bikes)
+            self.docks = array('i', docks)
+            self._complete = True
+        else:
+            for station_id, station_bikes, station_docks in zip(
+                    station_ids, bikes, docks):
+                row = self._row_of[station_id]
+                self.bikes[row] = station_bikes
+                self.docks[row] = station_docks
+                self._last_seen[row] = self.snapshots
+            self._complete = False
+        self.last_moment = moment
+        self.snapshots += 1
+
+    def _count_all(self, slot: int, elapsed: float,
+                   bikes: List[int]) -> None:
+        """Add the changes since the last snapshot, which was elapsed hours
+        before one in which the station in each row had the number of bikes
+        at that row of bikes, to the totals of hour of the week slot.
+        """
+
+        changes = list(map(operator.sub, bikes, self.bikes))
+        self.returns[slot] = array('d', map(
+            operator.add, self.returns[slot],
+            map(max, changes, itertools.repeat(0))))
+        self.rentals[slot] = array('d', map(
+            operator.sub, self.rentals[slot],
+            map(min, changes, itertools.repeat(0))))
+        self.hours[slot] = array('d', map(
+            operator.add, self.hours[slot], itertools.repeat(elapsed)))
+
+    def _count_each(self, slot: int, elapsed: float, station_ids: List[int],
+                    bikes: List[int], known: int) -> None:
+        """Add the changes since the last snapshot, which was elapsed hours
+        before one in which the station with id station_ids[i] had bikes[i]
+        bikes, to the totals of hour of the week slot. Only the stations in
+        the first known rows that were in the last snapshot are counted.
+        """
+
+        rentals = self.rentals[slot]
+        returns = self.returns[slot]
+        hours = self.hours[slot]
+        for station_id, station_bikes in zip(station_ids, bikes):
+            row = self._row_of[station_id]
+            if row >= known or not (self._complete or self._last_seen[row]
+                                    == self.snapshots - 1):
+                continue
+            change = station_bikes - self.bikes[row]
+            if change > 0:
+                returns[row] += change
+            else:
+                rentals[row] -= change
+            hours[row] += elapsed
+
+    def read_history(self, csv_file: TextIO) -> int:
+        """Add each snapshot in the history in the open CSV file csv_file,
+        one at a time, and return the number of snapshots added.
+
+        >>> import io
+        >>> model = DemandModel()
+        >>> model.read_history(io.StringIO(
+        ...     'timestamp,station_id,name,lat,lon,capacity,'
+        ...     'num_bikes_available,num_docks_available\\n'
+        ...     '2020-09-01T08:00:00,7090,Danforth,43.68,-79.33,15,4,11\\n'
+        ...     '2020-09-01T08:30:00,7090,Danforth,43.68,-79.33,15,1,14\\n'))
+        2
+        >>> model.rates(7090)[0][32]
+        6.0
+        """
+
+        reader = filter(None, csv.reader(csv_file))
+        header = [name.strip() for name in next(reader, [])]
+        positions = csv_positions(header)
+        by_snapshot = itertools.groupby(
+            reader, operator.itemgetter(header.index(TIMESTAMP_COLUMN)))
+        added = 0
+        for stamp, lines in by_snapshot:
+            values = list(zip(*lines))
+            self.add_snapshot(
+                datetime.datetime.fromisoformat(stamp),
+                convert_column(values[positions[ID]], int),
+                convert_column(values[positions[BIKES_AVAILABLE]], int),
+                convert_column(values[positions[DOCKS_AVAILABLE]], int))
+            added += 1
+        return added
+
+    def rates(self, station_id: int) -> Tuple[List[float], List[float]]:
+        """Return the rentals per hour and the returns per hour seen at the
+        station with id station_id in each hour of the week, or 0.0 for an
+        hour in which it was never seen.
+        """
+
+        row = self._row_of[station_id]
+        rentals = []
+        returns = []
+        for slot in range(SLOTS):
+            hours = self.hours[slot][row]
+            rentals.append(self.rentals[slot][row] / hours if hours else 0.0)
+            returns.append(self.returns[slot][row] / hours if hours else 0.0)
+        return rentals, returns
+
+    def forecast(self, horizon_hours: float = HORIZON_HOURS) \
+            -> List[Forecast]:
+        """Return a Forecast for each station, in row order, looking ahead
+        horizon_hours from the last snapshot.
+
+        Each station's bikes are expected to change at its rate of returns
+        less its rate of rentals in each hour of the week, and never to go
+        below zero or above its bikes plus docks in the last snapshot in
+        which it was seen. A station with no bikes or no docks left is
+        expected to run out of them in 0.0 hours.
+        """
+
+        forecasts = []
+        for row, station_id in enumerate(self.station_ids):
+            bikes = self.bikes[row]
+            docks = self.docks[row]
+            capacity = bikes + docks
+            level = float(bikes)
+            empty = 0.0 if bikes == 0 else None
+            full = 0.0 if docks == 0 else None
+            moment = self.last_moment
+            elapsed = 0.0
+            while elapsed < horizon_hours:
+                next_hour = moment.replace(minute=0, second=0,
+                                           microsecond=0) \
+                    + datetime.timedelta(hours=1)
+                step = min((next_hour - moment).total_seconds() / 3600,
+                           horizon_hours - elapsed)
+                slot = _slot(moment)
+                hours = self.hours[slot][row]
+                change = (self.returns[slot][row] - self.rentals[slot][row]) \
+                    / hours if hours else 0.0
+                if change < 0 and empty is None and \
+                        level + change * step <= 0:
+                    empty = round(elapsed + level / -change, 3)
+                if change > 0 and full is None and \
+                        level + change * step >= capacity:
+                    full = round(elapsed + (capacity - level) / change, 3)
+                level = min(max(level + change * step, 0), capacity)
+                elapsed += step
+                moment = next_hour
+            forecasts.append(Forecast(station_id, bikes, docks, empty,
+                                      full))
+        return forecasts
+
+
+def _synthetic_history(stations: List["Station"], start: datetime.datetime,
+                       snapshots: int, minutes: int,
+                       seed: int = 0) -> Iterator[str]:
+    """Return an iterator over the lines of a history of snapshots of
+    stations, minutes apart starting at start. Bikes are rented from half
+    of the stations in the morning and returned in the evening, and the
+    other way around at the rest.
+    """
+
+    generator = random.Random(seed)
+    yield ','.join([TIMESTAMP_COLUMN, 'station_id', 'name', 'lat', 'lon',
+                    'capacity', 'num_bikes_available',
+                    'num_docks_available']) + '\n'
+    levels = [station[BIKES_AVAILABLE] for station in stations]
+    for step in range(snapshots):
+        moment = start + datetime.timedelta(minutes=step * minutes)
+        stamp = moment.isoformat()
+        direction = 1 if 7 <= moment.hour < 10 else \
+            -1 if 16 <= moment.hour < 19 else 0
+        for number, station in enumerate(stations):
+            capacity = station[BIKES_AVAILABLE] + station[DOCKS_AVAILABLE]
+            change = generator.choice([-1, 0, 0, 1])
+            if direction:
+                change += direction if number % 2 else -direction
+            levels[number] = min(max(levels[number] + change, 0), capacity)
+            yield '{},{},,{},{},{},{},{}\n'.format(
+                stamp, station[ID], station[LATITUDE], station[LONGITUDE],
+                capacity,
+                levels[number], capacity - levels[number])
+
+
+if __name__ == '__main__':
+    import resource
+    import time
+
+    import synthetic
+
+    history_stations = synthetic.synthetic_stations(1000)
+    history = _synthetic_history(history_stations,
+                                 datetime.datetime(2020, 9, 7), 7 * 288, 5)
+    history_model = DemandModel()
+    began = time.perf_counter()
+    history_snapshots = history_model.read_history(history)
+    print('{} snapshots of {} stations in {:.1f}s, peak memory {} MB'.format(
+        history_snapshots, len(history_model.station_ids),
+        time.perf_counter() - began,
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024))
+    soon = sorted((forecast for forecast in history_model.forecast()
+                   if forecast.bikes and forecast.hours_to_empty is not None),
+                  key=operator.attrgetter('hours_to_empty'))
+    print('{} stations expected to run out of bikes within {} hours; '
+          'first:'.format(len(soon), HORIZON_HOURS))
+    for forecast in soon[:10]:
+        print('  station {} with {} bikes: {:.1f} hours'.format(
+            forecast.station_id, forecast.bikes, forecast.hours_to_empty))
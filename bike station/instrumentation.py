@@ -0,0 +1,311 @@
+"""Opt-in metrics for the functions in bikes.
+
+While instrumentation is enabled, each function named in INSTRUMENTED is
+replaced, in bikes and in every module that imported it from bikes, by a
+wrapper that records its number of calls, a histogram of how long the calls
+took, and the number of station rows they examined. Disabling
+instrumentation puts the original functions back, so there is no cost at
+all while it is off.
+
+Only the outermost instrumented call is recorded. When an instrumented
+function calls another, as rent_bike calls find_station, the inner call is
+not wrapped: its time and rows are part of the outer call's, and it is not
+counted on its own.
+
+Rows examined are counted as follows. A function that scans a list of
+stations examines each station it looks at: every station, or for a lookup
+by id, the stations up to and including the one found. In a StationTable a
+lookup by id examines one row, a cached total none, and a threshold query
+the rows it returns.
+
+The functions do not report where they found a station, so for a lookup by
+id in a list the wrapper scans the list again, after the call, to count the
+rows. That scan is not part of the recorded time, but it roughly doubles
+the time a lookup in a long list takes while instrumentation is enabled.
+
+The metrics can be read as a dict with metrics_snapshot, or as text in the
+Prometheus exposition format with prometheus_text.
+"""
+
+import bisect
+import functools
+import inspect
+import sys
+import threading
+import time
+from typing import Callable, Dict, List
+
+import bikes
+from bikes import BIKES_AVAILABLE, SAMPLE_STATIONS, StationTable
+
+# The bikes functions that are instrumented.
+INSTRUMENTED = ['clean_data', 'find_station', 'get_station_info',
+                'get_total', 'get_stations_with_n_docks',
+                'get_stations_with_n_bikes', 'get_nearest_station',
+                'rent_bike', 'return_bike', 'redistribute_bikes']
+
+# The upper bounds, in seconds, of the latency histogram buckets. Calls
+# slower than the last bound are counted in one more bucket.
+LATENCY_BUCKETS = [0.000001, 0.00001, 0.0001, 0.001, 0.01, 0.1, 1.0]
+
+
+class FunctionMetrics:
+    """The metrics recorded for one function."""
+
+    def __init__(self) -> None:
+        """Initialize metrics with no calls recorded."""
+
+        self.clear()
+
+    def clear(self) -> None:
+        """Forget every call recorded."""
+
+        self.calls = 0
+        self.seconds = 0.0
+        self.rows_examined = 0
+        self.latency_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def record(self, seconds: float, rows: int) -> None:
+        """Record a call that took seconds and examined rows rows."""
+
+        self.calls += 1
+        self.seconds += seconds
+        self.rows_examined += rows
+        self.latency_counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+
+# The metrics of each function in INSTRUMENTED, and the original function
+# and its wrapper while instrumentation is enabled.
+_metrics = {name: FunctionMetrics() for name in INSTRUMENTED}
+_originals = {}
+_wrappers = {}
+
+# The number of instrumented calls under way in each thread, so that calls
+# made by another instrumented function are not recorded.
+_calls = threading.local()
+
+
+def _lookup_rows(station_id: int, stations: List["Station"]) -> int:
+    """Return the number of rows examined to find the station with id
+    station_id in stations. For a list, this repeats the scan the lookup
+    made, up to the station found.
+
+    >>> _lookup_rows(7486, SAMPLE_STATIONS), _lookup_rows(1, SAMPLE_STATIONS)
+    (2, 3)
+    """
+
+    if isinstance(stations, StationTable):
+        return 1
+    for rows, station in enumerate(stations, 1):
+        if station[bikes.ID] == station_id:
+            return rows
+    return len(stations)
+
+
+def _rows_examined(name: str, arguments: Dict[str, object],
+                   result: object) -> int:
+    """Return the number of rows examined by the call of the bikes function
+    named name with arguments, a dict mapping its parameter names to their
+    values, which returned result.
+    """
+
+    if name in ['find_station', 'get_station_info', 'rent_bike',
+                'return_bike']:
+        return _lookup_rows(arguments['station_id'], arguments['stations'])
+    stations = arguments['data' if name == 'clean_data' else 'stations']
+    if isinstance(stations, StationTable):
+        if name == 'get_total':
+            return 0
+        if name in ['get_stations_with_n_docks', 'get_stations_with_n_bikes']:
+            return len(result)
+    return len(stations)
+
+
+def _instrument(name: str, function: Callable) -> Callable:
+    """Return a wrapper of function, the bikes function named name, that
+    records its metrics.
+    """
+
+    metrics = _metrics[name]
+    clock = time.perf_counter
+    signature = inspect.signature(function)
+
+    @functools.wraps(function)
+    def wrapper(*args: object, **kwargs: object) -> object:
+        """Call the wrapped function and, unless another instrumented
+        function called it, record its metrics.
+        """
+
+        if getattr(_calls, 'depth', 0):
+            return function(*args, **kwargs)
+        _calls.depth = 1
+        try:
+            began = clock()
+            result = function(*args, **kwargs)
+            seconds = clock() - began
+        finally:
+            _calls.depth = 0
+        arguments = signature.bind(*args, **kwargs).arguments
+        metrics.record(seconds, _rows_examined(name, arguments, result))
+        return result
+
+    return wrapper
+
+
+def _replace_everywhere(replacements: Dict[int, Callable]) -> None:
+    """Replace every module attribute that is a function whose id is a key
+    of replacements with the function that key maps to.
+    """
+
+    for module in list(sys.modules.values()):
+        attributes = getattr(module, '__dict__', None)
+        if not isinstance(attributes, dict):
+            continue
+        for name in INSTRUMENTED:
+            value = attributes.get(name)
+            if value is not None and id(value) in replacements:
+                attributes[name] = replacements[id(value)]
+
+
+def enable() -> None:
+    """Start recording metrics for the functions in INSTRUMENTED.
+
+    >>> enable()
+    >>> reset()
+    >>> bikes.rent_bike(7486, [station[:] for station in SAMPLE_STATIONS])
+    True
+    >>> metrics_snapshot()['rent_bike']['rows_examined']
+    2
+    >>> 'find_station' in metrics_snapshot()
+    False
+    >>> bikes.get_total(index=BIKES_AVAILABLE, stations=SAMPLE_STATIONS)
+    23
+    >>> metrics_snapshot()['get_total']['rows_examined']
+    3
+    >>> disable()
+    >>> bikes.rent_bike.__name__, hasattr(bikes.rent_bike, '__wrapped__')
+    ('rent_bike', False)
+    """
+
+    if _originals:
+        return
+    for name in INSTRUMENTED:
+        _originals[name] = getattr(bikes, name)
+        _wrappers[name] = _instrument(name, _originals[name])
+    _replace_everywhere({id(_originals[name]): _wrappers[name]
+                         for name in INSTRUMENTED})
+
+
+def disable() -> None:
+    """Stop recording metrics and put the original functions back. The
+    metrics recorded so far are kept.
+    """
+
+    if not _originals:
+        return
+    _replace_everywhere({id(_wrappers[name]): _originals[name]
+                         for name in INSTRUMENTED})
+    _originals.clear()
+    _wrappers.clear()
+
+
+def is_enabled() -> bool:
+    """Return True if and only if metrics are being recorded."""
+
+    return bool(_originals)
+
+
+def reset() -> None:
+    """Forget all metrics recorded so far."""
+
+    for name in INSTRUMENTED:
+        _metrics[name].clear()
+
+
+def metrics_snapshot() -> Dict[str, Dict[str, object]]:
+    """Return a copy of the metrics recorded so far: a dict mapping the name
+    of each function called at least once to a dict of its calls, total
+    seconds, rows examined, and the number of calls that took no more than
+    each bound in LATENCY_BUCKETS, followed by the number that took longer.
+
+    >>> reset()
+    >>> metrics_snapshot()
+    {}
+    """
+
+    return {name: {'calls': metrics.calls, 'seconds': metrics.seconds,
+                   'rows_examined': metrics.rows_examined,
+                   'latency_counts': list(metrics.latency_counts)}
+            for name, metrics in _metrics.items() if metrics.calls}
+
+
+def prometheus_text(prefix: str = 'bikes') -> str:
+    """Return the metrics recorded so far in the Prometheus text exposition
+    format, with metric names starting with prefix.
+
+    >>> reset()
+    >>> enable()
+    >>> bikes.get_total(BIKES_AVAILABLE, SAMPLE_STATIONS)
+    23
+    >>> disable()
+    >>> print(prometheus_text())  # doctest: +ELLIPSIS
+    # HELP bikes_calls_total Calls of each bikes function.
+    # TYPE bikes_calls_total counter
+    bikes_calls_total{function="get_total"} 1
+    # HELP bikes_rows_examined_total Rows examined by each bikes function.
+    # TYPE bikes_rows_examined_total counter
+    bikes_rows_examined_total{function="get_total"} 3
+    # HELP bikes_call_seconds Time taken by calls of each bikes function.
+    # TYPE bikes_call_seconds histogram
+    bikes_call_seconds_bucket{function="get_total",le="1e-06"} ...
+    bikes_call_seconds_bucket{function="get_total",le="+Inf"} 1
+    bikes_call_seconds_sum{function="get_total"} ...
+    bikes_call_seconds_count{function="get_total"} 1
+    """
+
+    snapshot = metrics_snapshot()
+    lines = ['# HELP {}_calls_total Calls of each bikes function.'.format(
+        prefix), '# TYPE {}_calls_total counter'.format(prefix)]
+    for name, metrics in snapshot.items():
+        lines.append('{}_calls_total{{function="{}"}} {}'.format(
+            prefix, name, metrics['calls']))
+    lines += ['# HELP {}_rows_examined_total Rows examined by each bikes '
+              'function.'.format(prefix),
+              '# TYPE {}_rows_examined_total counter'.format(prefix)]
+    for name, metrics in snapshot.items():
+        lines.append('{}_rows_examined_total{{function="{}"}} {}'.format(
+            prefix, name, metrics['rows_examined']))
+    lines += ['# HELP {}_call_seconds Time taken by calls of each bikes '
+              'function.'.format(prefix),
+              '# TYPE {}_call_seconds histogram'.format(prefix)]
+    for name, metrics in snapshot.items():
+        count = 0
+        for bound, calls in zip(LATENCY_BUCKETS + ['+Inf'],
+                                metrics['latency_counts']):
+            count += calls
+            lines.append('{}_call_seconds_bucket{{function="{}",le="{}"}} '
+                         '{}'.format(prefix, name, bound, count))
+        lines.append('{}_call_seconds_sum{{function="{}"}} {}'.format(
+            prefix, name, metrics['seconds']))
+        lines.append('{}_call_seconds_count{{function="{}"}} {}'.format(
+            prefix, name, metrics['calls']))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    import random
+
+    import synthetic
+
+    demo_stations = StationTable(synthetic.synthetic_stations(10000))
+    demo_ids = list(demo_stations.column(bikes.ID))
+    generator = random.Random(0)
+    enable()
+    for _ in range(10000):
+        bikes.rent_bike(generator.choice(demo_ids), demo_stations)
+        bikes.return_bike(generator.choice(demo_ids), demo_stations)
+    for n in range(20):
+        bikes.get_stations_with_n_docks(n, demo_stations)
+    bikes.redistribute_bikes(demo_stations)
+    disable()
+    print(prometheus_text())
@@ -0,0 +1,305 @@
+"""Plan truck routes that carry out a redistribution of bikes.
+
+redistribute_bikes moves bikes between stations instantly. In practice bikes
+are moved by trucks that can carry a limited number of bikes at a time. The
+functions here take the moves from plan_redistribution and build a route
+for each truck: a list of stops, each a [station id, change in bikes
+available] pair, where a negative change means the truck picks bikes up and
+a positive change means it drops them off.
+
+Routes are built greedily, always driving to the nearest station where the
+truck can pick up or drop off bikes, and then shortened with 2-opt moves
+that never overload or overdraw the truck.
+
+Run this module to benchmark the planner on stations.csv and on larger
+synthetic networks.
+"""
+
+import math
+import time
+from typing import Dict, List, Tuple
+
+from bikes import (ID, LATITUDE, LONGITUDE, SAMPLE_STATIONS,
+                   get_lat_lon_distance, plan_redistribution)
+from station_index import StationIndex
+
+# The number of nearby stops considered for each 2-opt move.
+NEIGHBOURS = 8
+
+# The most passes 2-opt makes over a route.
+MAX_PASSES = 10
+
+
+def plan_rebalancing(stations: List["Station"], truck_capacity: int,
+                     trucks: int = 1) -> List[List[List[int]]]:
+    """Return truck routes that carry out the moves of
+    plan_redistribution(stations), as described in plan_routes.
+
+    >>> plan_rebalancing(SAMPLE_STATIONS, 10)
+    [[[7571, -6], [7090, 2], [7486, 4]]]
+    """
+
+    return plan_routes(plan_redistribution(stations), stations,
+                       truck_capacity, trucks)
+
+
+def plan_routes(moves: List[List[int]], stations: List["Station"],
+                truck_capacity: int, trucks: int = 1,
+                start: Tuple[float, float] = None,
+                passes: int = MAX_PASSES) -> List[List[List[int]]]:
+    """Return a list of routes, one for each truck used, that carry out the
+    [station id, change in bikes available] moves in moves, where each
+    station id is in stations. Every truck carries at most truck_capacity
+    bikes and starts empty at start, a (latitude, longitude) pair that
+    defaults to the centre of stations.
+
+    The stops are shared out so that each of the trucks makes about the same
+    number of pick-ups. A move may be split over several stops. If more
+    bikes are picked up than are needed, a truck that is full with nowhere
+    left to drop off ends its route and takes the extra bikes back to start,
+    and the pick-ups still to be made are left to further routes, each a
+    later trip by one of the trucks. So there may be more routes than
+    trucks, and every move is made. Each route is improved with at most
+    passes passes of improve_route.
+
+    Precondition: truck_capacity > 0 and trucks > 0
+
+    >>> plan_routes([[7090, 2], [7486, 5], [7571, -6]], SAMPLE_STATIONS, 4)
+    [[[7571, -4], [7090, 2], [7571, -2], [7486, 4]]]
+    >>> plan_routes([[7090, 2], [7486, -3], [7571, -6]], SAMPLE_STATIONS, 4)
+    [[[7571, -4], [7090, 2], [7571, -2]], [[7486, -3]]]
+    """
+
+    stations_by_id = {station[ID]: station for station in stations}
+    if start is None:
+        start = (sum(station[LATITUDE] for station in stations)
+                 / len(stations),
+                 sum(station[LONGITUDE] for station in stations)
+                 / len(stations))
+
+    remaining = {station_id: change for station_id, change in moves}
+    pick_ups = StationIndex([stations_by_id[station_id]
+                             for station_id, change in moves if change < 0])
+    drop_offs = StationIndex([stations_by_id[station_id]
+                              for station_id, change in moves if change > 0])
+    stops_per_truck = math.ceil(len(pick_ups) / trucks)
+
+    routes = []
+    while len(pick_ups) > 0:
+        route = _greedy_route(start, remaining, pick_ups, drop_offs,
+                              stations_by_id, truck_capacity,
+                              len(pick_ups) - stops_per_truck
+                              if len(routes) < trucks - 1 else 0)
+        improve_route(route, start, stations_by_id, truck_capacity, passes)
+        routes.append(route)
+    return routes
+
+
+def _greedy_route(start: Tuple[float, float], remaining: Dict[int, int],
+                  pick_ups: StationIndex, drop_offs: StationIndex,
+                  stations_by_id: Dict[int, "Station"], truck_capacity: int,
+                  pick_ups_left: int) -> List[List[int]]:
+    """Return the route of a truck starting empty at start that repeatedly
+    drives to the nearest station in pick_ups or drop_offs where it can pick
+    up or drop off bikes, until the pick_ups index is down to pick_ups_left
+    stations and the truck is empty or there is nowhere left to drop off.
+
+    remaining maps each station id to the change still to be made there,
+    and is updated along with pick_ups and drop_offs as the route is built.
+    """
+
+    lat, lon = start
+    load = 0
+    route = []
+    while True:
+        candidates = []
+        if load < truck_capacity and len(pick_ups) > pick_ups_left:
+            candidates.append(_nearest(lat, lon, pick_ups, stations_by_id))
+        if load > 0 and len(drop_offs) > 0:
+            candidates.append(_nearest(lat, lon, drop_offs, stations_by_id))
+        if not candidates:
+            return route
+
+        distance, station_id = min(candidates)
+        if remaining[station_id] < 0:
+            change = -min(-remaining[station_id], truck_capacity - load)
+            index = pick_ups
+        else:
+            change = min(remaining[station_id], load)
+            index = drop_offs
+        load -= change
+        remaining[station_id] -= change
+        if remaining[station_id] == 0:
+            index.remove(station_id)
+
+        route.append([station_id, change])
+        lat = stations_by_id[station_id][LATITUDE]
+        lon = stations_by_id[station_id][LONGITUDE]
+
+
+def _nearest(lat: float, lon: float, index: StationIndex,
+             stations_by_id: Dict[int, "Station"]) -> Tuple[float, int]:
+    """Return the distance to and the id of the station in index nearest to
+    (lat, lon).
+    """
+
+    station_id = index.nearest(lat, lon, False)
+    station = stations_by_id[station_id]
+    return (get_lat_lon_distance(lat, lon, station[LATITUDE],
+                                 station[LONGITUDE]), station_id)
+
+
+def route_length(route: List[List[int]], start: Tuple[float, float],
+                 stations_by_id: Dict[int, "Station"]) -> float:
+    """Return the distance in kilometers a truck drives to follow route from
+    start.
+
+    >>> stations_by_id = {station[ID]: station for station in SAMPLE_STATIONS}
+    >>> route_length([[7090, 2], [7571, -2]], (43.681991, -79.329455), \
+                     stations_by_id)
+    1.197
+    """
+
+    points = [start] + [(stations_by_id[station_id][LATITUDE],
+                         stations_by_id[station_id][LONGITUDE])
+                        for station_id, _ in route]
+    return round(sum(get_lat_lon_distance(*points[i], *points[i + 1])
+                     for i in range(len(points) - 1)), 3)
+
+
+def improve_route(route: List[List[int]], start: Tuple[float, float],
+                  stations_by_id: Dict[int, "Station"],
+                  truck_capacity: int, passes: int = MAX_PASSES) -> None:
+    """Shorten route, which a truck carrying at most truck_capacity bikes
+    follows from start, by reversing parts of it (2-opt moves), making at
+    most passes passes over the route. Only moves that join a stop to one of
+    its NEIGHBOURS nearest stops are tried, and a move is only made if the
+    truck's load stays between 0 and truck_capacity.
+    """
+
+    if len(route) < 3 or passes <= 0:
+        return
+
+    points = [start] + [(stations_by_id[station_id][LATITUDE],
+                         stations_by_id[station_id][LONGITUDE])
+                        for station_id, _ in route]
+    # Position 0 is the start and position i is stop route[i - 1].
+    changes = [0] + [change for _, change in route]
+    order = list(range(len(points)))
+    loads = [0]
+    for change in changes[1:]:
+        loads.append(loads[-1] - change)
+
+    unique_stops = {station_id: stations_by_id[station_id]
+                    for station_id, _ in route}
+    index = StationIndex(list(unique_stops.values()))
+    neighbours = {station_id: index.k_nearest(
+        station[LATITUDE], station[LONGITUDE], NEIGHBOURS + 1, False)[1:]
+                  for station_id, station in unique_stops.items()}
+    positions = {}
+    for position, (station_id, _) in enumerate(route, 1):
+        positions.setdefault(station_id, set()).add(position)
+
+    def distance(i: int, j: int) -> float:
+        """Return the distance between the stops at positions i and j."""
+
+        return get_lat_lon_distance(*points[order[i]], *points[order[j]])
+
+    def improve_at(i: int) -> bool:
+        """Make the first improving 2-opt move that replaces the edge
+        ending at position i, and return True if and only if there was one.
+        """
+
+        for other_id in neighbours[route[order[i - 1] - 1][0]]:
+            for j in sorted(positions[other_id]):
+                if j <= i:
+                    continue
+                delta = distance(i - 1, j) - distance(i - 1, i)
+                if j < last:
+                    delta += distance(i, j + 1) - distance(j, j + 1)
+                if delta < 0 and _fits(changes, order, loads[i - 1], i, j,
+                                       truck_capacity):
+                    _reverse(route, order, changes, loads, positions, i, j)
+                    return True
+        return False
+
+    last = len(order) - 1
+    improved = True
+    while improved and passes > 0:
+        improved = False
+        passes -= 1
+        for i in range(2, last + 1):
+            if improve_at(i):
+                improved = True
+
+    route[:] = [[route[position - 1][0], changes[position]]
+                for position in order[1:]]
+
+
+def _fits(changes: List[int], order: List[int], load: int, i: int, j: int,
+          truck_capacity: int) -> bool:
+    """Return True if and only if a truck carrying load bikes can visit the
+    stops at positions j, j - 1, ..., i in that order without its load going
+    below 0 or above truck_capacity.
+    """
+
+    for position in range(j, i - 1, -1):
+        load -= changes[order[position]]
+        if load < 0 or load > truck_capacity:
+            return False
+    return True
+
+
+def _reverse(route: List[List[int]], order: List[int], changes: List[int],
+             loads: List[int], positions: Dict[int, set], i: int,
+             j: int) -> None:
+    """Reverse the stops at positions i to j of order, updating loads and
+    positions to match.
+    """
+
+    for position in range(i, j + 1):
+        positions[route[order[position] - 1][0]].discard(position)
+    order[i:j + 1] = order[i:j + 1][::-1]
+    for position in range(i, j + 1):
+        positions[route[order[position] - 1][0]].add(position)
+        loads[position] = loads[position - 1] - changes[order[position]]
+
+
+def _benchmark(name: str, stations: List["Station"], truck_capacity: int,
+               trucks: int) -> None:
+    """Plan rebalancing routes for stations and print how long it took and
+    how far the trucks drive, before and after 2-opt.
+    """
+
+    start = (sum(station[LATITUDE] for station in stations) / len(stations),
+             sum(station[LONGITUDE] for station in stations) / len(stations))
+    stations_by_id = {station[ID]: station for station in stations}
+    moves = plan_redistribution(stations)
+
+    began = time.perf_counter()
+    greedy = plan_routes(moves, stations, truck_capacity, trucks, start, 0)
+    greedy_time = time.perf_counter() - began
+    began = time.perf_counter()
+    routes = plan_routes(moves, stations, truck_capacity, trucks, start)
+    total_time = time.perf_counter() - began
+
+    print('{:>12} {:>7} {:>6} {:>6} {:>10.1f} {:>10.1f} {:>8.2f} {:>8.2f}'
+          .format(name, len(stations), len(moves),
+                  sum(len(route) for route in routes),
+                  sum(route_length(route, start, stations_by_id)
+                      for route in greedy),
+                  sum(route_length(route, start, stations_by_id)
+                      for route in routes), greedy_time, total_time))
+
+
+if __name__ == '__main__':
+    import synthetic
+
+    print('{:>12} {:>7} {:>6} {:>6} {:>10} {:>10} {:>8} {:>8}'.format(
+        'network', 'size', 'moves', 'stops', 'greedy km', '2-opt km',
+        'greedy s', 'total s'))
+    seed_stations = synthetic.load_seed_stations()
+    _benchmark('stations.csv', seed_stations, 20, 4)
+    for size in [2000, 5000, 10000, 20000]:
+        _benchmark('synthetic', synthetic.synthetic_stations(
+            size, seed_stations), 20, max(1, size // 500))
@@ -0,0 +1,227 @@
+"""A station store split into geographic shards, each in its own process.
+
+The stations are partitioned by grid cells of CELL_SIZE degrees of latitude
+and longitude, and each cell belongs to one shard. Every shard is a worker
+process holding a StationTable and a StationIndex of its stations. Requests
+about one station are sent only to the shard that owns it; nearest-station,
+dock and total queries are sent to every shard at once and the answers are
+merged.
+
+Each shard remembers the position of its stations in the original list, so
+merged answers are exactly those the functions in bikes would give on that
+list, including which station wins a tie.
+"""
+
+import heapq
+import math
+import multiprocessing
+import multiprocessing.connection
+from typing import List, Tuple
+
+from bikes import (ID, LATITUDE, LONGITUDE, BIKES_AVAILABLE, SAMPLE_STATIONS,
+                   StationTable, get_lat_lon_distance, get_station_info,
+                   get_stations_with_n_docks, get_total, rent_bike,
+                   return_bike)
+from station_index import StationIndex
+
+# The size, in degrees of latitude and longitude, of the grid cells that are
+# assigned to shards.
+CELL_SIZE = 0.02
+
+
+def cell_of(lat: float, lon: float) -> Tuple[int, int]:
+    """Return the grid cell containing the location (lat, lon).
+
+    >>> cell_of(43.681991, -79.329455)
+    (2184, -3967)
+    """
+
+    return (math.floor(lat / CELL_SIZE), math.floor(lon / CELL_SIZE))
+
+
+def _serve_shard(connection: multiprocessing.connection.Connection,
+                 stations: List["Station"], positions: List[int]) -> None:
+    """Answer requests sent on connection about stations, whose positions in
+    the original stations list are positions, until told to stop.
+    """
+
+    table = StationTable(stations)
+    index = StationIndex(table)
+    while True:
+        op, argument = connection.recv()
+        if op == 'stop':
+            connection.close()
+            return
+        if op == 'rent':
+            result = rent_bike(argument, table)
+        elif op == 'return':
+            result = return_bike(argument, table)
+        elif op == 'info':
+            result = get_station_info(argument, table)
+        elif op == 'total':
+            result = get_total(argument, table)
+        elif op == 'docks':
+            result = [(positions[table.find(station_id)], station_id)
+                      for station_id in get_stations_with_n_docks(argument,
+                                                                  table)]
+        else:
+            lat, lon, with_kiosk = argument
+            station_id = index.nearest(lat, lon, with_kiosk)
+            if station_id == -1:
+                result = None
+            else:
+                station = table[table.find(station_id)]
+                result = (get_lat_lon_distance(station[LATITUDE],
+                                               station[LONGITUDE], lat, lon),
+                          positions[table.find(station_id)], station_id)
+        connection.send(result)
+
+
+class ShardedStationStore:
+    """A store of stations split over worker processes.
+
+    Close the store when done with it, or use it in a with statement.
+
+    >>> with ShardedStationStore(SAMPLE_STATIONS, 2) as store:
+    ...     store.get_nearest_station(43.671134, -79.325164, True)
+    ...     store.rent_bike(7090)
+    ...     store.get_station_info(7090)
+    ...     store.get_total(BIKES_AVAILABLE)
+    ...     store.get_stations_with_n_docks(11)
+    7090
+    True
+    ['Danforth Ave / Lamb Ave', 3, 11, True]
+    22
+    [7090, 7486]
+    """
+
+    def __init__(self, stations: List["Station"], shards: int) -> None:
+        """Initialize a new store of the stations in stations, split over
+        at most shards worker processes.
+
+        Precondition: shards > 0
+        """
+
+        members = [([], []) for _ in range(shards)]
+        self._shard_of = {}
+        for position, station in enumerate(stations):
+            shard = hash(cell_of(station[LATITUDE], station[LONGITUDE])) \
+                % shards
+            if station[ID] not in self._shard_of:
+                self._shard_of[station[ID]] = shard
+            members[shard][0].append(list(station))
+            members[shard][1].append(position)
+
+        # Shards that get no stations are not started, so the rest are
+        # numbered again.
+        numbers = {}
+        self._connections = []
+        self._processes = []
+        for shard, (shard_stations, positions) in enumerate(members):
+            if not shard_stations:
+                continue
+            here, there = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=_serve_shard, args=(there, shard_stations, positions),
+                daemon=True)
+            process.start()
+            there.close()
+            numbers[shard] = len(self._connections)
+            self._connections.append(here)
+            self._processes.append(process)
+        self._shard_of = {station_id: numbers[shard] for station_id, shard
+                          in self._shard_of.items()}
+
+    def __enter__(self) -> 'ShardedStationStore':
+        """Return this store."""
+
+        return self
+
+    def __exit__(self, *exception: object) -> None:
+        """Close this store."""
+
+        self.close()
+
+    def close(self) -> None:
+        """Stop the worker processes of this store."""
+
+        for connection in self._connections:
+            connection.send(('stop', None))
+            connection.close()
+        for process in self._processes:
+            process.join()
+        self._connections = []
+        self._processes = []
+
+    def _ask(self, station_id: int, op: str) -> object:
+        """Return the answer to op about the station with id station_id from
+        the shard that owns it.
+        """
+
+        connection = self._connections[self._shard_of[station_id]]
+        connection.send((op, station_id))
+        return connection.recv()
+
+    def _ask_all(self, op: str, argument: object) -> list:
+        """Return a list of the answers to op with argument from every shard,
+        which all work on it at the same time.
+        """
+
+        for connection in self._connections:
+            connection.send((op, argument))
+        return [connection.recv() for connection in self._connections]
+
+    def rent_bike(self, station_id: int) -> bool:
+        """Rent a bike from the station with id station_id, as rent_bike
+        does.
+        """
+
+        if station_id not in self._shard_of:
+            return False
+        return self._ask(station_id, 'rent')
+
+    def return_bike(self, station_id: int) -> bool:
+        """Return a bike to the station with id station_id, as return_bike
+        does.
+        """
+
+        if station_id not in self._shard_of:
+            return False
+        return self._ask(station_id, 'return')
+
+    def get_station_info(self, station_id: int) -> list:
+        """Return the information get_station_info gives about the station
+        with id station_id.
+        """
+
+        if station_id not in self._shard_of:
+            return []
+        return self._ask(station_id, 'info')
+
+    def get_total(self, index: int) -> int:
+        """Return the sum of the column given by index over all stations, as
+        get_total does.
+        """
+
+        return sum(self._ask_all('total', index))
+
+    def get_stations_with_n_docks(self, n: int) -> List[int]:
+        """Return the ids of the stations with at least n docks available, in
+        the same order as the original stations list.
+        """
+
+        return [station_id for _, station_id in
+                heapq.merge(*self._ask_all('docks', n))]
+
+    def get_nearest_station(self, lat: float, lon: float,
+                            with_kiosk: bool) -> int:
+        """Return the id of the station nearest to (lat, lon), as
+        get_nearest_station does. Return -1 if there is no such station.
+        """
+
+        answers = [answer for answer in
+                   self._ask_all('nearest', (lat, lon, with_kiosk))
+                   if answer is not None]
+        if not answers:
+            return -1
+        return min(answers)[2]
@@ -0,0 +1,273 @@
+"""A station table in shared memory, read by many processes at once.
+
+One process creates a SharedStationTable, which copies a snapshot of its
+stations (in the layout of the snapshot module) into a block of shared
+memory. Other processes attach to the block by name and get a StationTable
+whose columns are the shared memory itself, so nothing is pickled or
+copied between processes.
+
+Exactly one process may write to the table. Readers never take a lock:
+the block starts with a sequence number that the writer makes odd before
+each change and even again after it (a seqlock). A reader notes the
+sequence number, answers its query, and tries again if the number was odd
+or has changed since, so every answer comes from a state the table was
+really in. Station ids, names and locations never change, so queries that
+only use them, such as nearest-station lookups from a StationIndex built by
+each reader, need no retries at all.
+
+Run this module to measure how read throughput grows with the number of
+reader processes while a writer applies rentals and returns.
+"""
+
+import multiprocessing
+import os
+import random
+import time
+from io import BytesIO
+from multiprocessing import shared_memory
+from typing import Callable, List, Tuple
+
+from bikes import (ID, BIKES_AVAILABLE, SAMPLE_STATIONS, get_station_info,
+                   rent_bike, return_bike)
+from snapshot import table_from_buffer, write_snapshot_to
+from transactions import BatchResult, apply_events
+
+# The bytes before the snapshot in a shared block. The sequence number
+# takes the first 8; the rest keeps the snapshot on its own cache line.
+SEQUENCE_SIZE = 64
+
+
+class SharedStationTable:
+    """A table of stations in shared memory, with one writer and any number
+    of readers.
+
+    Close the table in every process when done with it; the process that
+    created it also removes the shared memory when it closes.
+
+    >>> writer = SharedStationTable.create(SAMPLE_STATIONS)
+    >>> reader = SharedStationTable.attach(writer.name)
+    >>> writer.rent_bike(7090)
+    True
+    >>> reader.read(get_station_info, 7090)
+    ['Danforth Ave / Lamb Ave', 3, 11, True]
+    >>> writer.apply_events([['return', 7090], ['rent', 7000]]).results
+    [True, False]
+    >>> reader.table[0][BIKES_AVAILABLE]
+    4
+    >>> reader.close()
+    >>> writer.close()
+    """
+
+    def __init__(self, memory: shared_memory.SharedMemory,
+                 owner: bool) -> None:
+        """Initialize a table of the stations in the shared block memory.
+        If owner is True, closing the table removes the block.
+
+        Use create or attach rather than calling this directly.
+        """
+
+        self._memory = memory
+        self._owner = owner
+        self._view = memoryview(memory.buf)
+        self._sequence = self._view[:8].cast('Q')
+        self.table = table_from_buffer(self._view[SEQUENCE_SIZE:],
+                                       memory.name, shared=True)
+        # Station ids never change, so the index find uses is built now
+        # rather than by a reader, which would have to start again whenever
+        # the writer made a change while it was being built.
+        self.table.find(-1)
+
+    @classmethod
+    def create(cls, stations: List["Station"]) -> 'SharedStationTable':
+        """Return a new table in a new block of shared memory holding a copy
+        of stations, which may be a list or a StationTable. The calling
+        process is the table's writer.
+        """
+
+        snapshot_file = BytesIO()
+        write_snapshot_to(stations, snapshot_file)
+        snapshot = snapshot_file.getbuffer()
+        memory = shared_memory.SharedMemory(
+            create=True, size=SEQUENCE_SIZE + len(snapshot))
+        memory.buf[SEQUENCE_SIZE:SEQUENCE_SIZE + len(snapshot)] = snapshot
+        snapshot.release()
+        return cls(memory, True)
+
+    @classmethod
+    def attach(cls, name: str) -> 'SharedStationTable':
+        """Return the table in the existing block of shared memory named
+        name.
+        """
+
+        return cls(shared_memory.SharedMemory(name), False)
+
+    @property
+    def name(self) -> str:
+        """The name other processes use to attach to this table."""
+
+        return self._memory.name
+
+    def close(self) -> None:
+        """Stop using this table, and remove its shared memory if this
+        process created it.
+        """
+
+        # Every column is a memoryview or a NamePool, and the shared memory
+        # cannot be closed while any of them still holds a view of it.
+        for column in self.table.columns:
+            column.release()
+        self._sequence.release()
+        self._view.release()
+        self._memory.close()
+        if self._owner:
+            self._memory.unlink()
+
+    def read(self, query: Callable[..., object], *args: object) -> object:
+        """Return query(*args, self.table), retrying until it has run while
+        the writer was not changing the table.
+
+        query must not change the table.
+        """
+
+        sequence = self._sequence
+        while True:
+            before = sequence[0]
+            if before % 2 == 1:
+                time.sleep(0)
+                continue
+            try:
+                result = query(*args, self.table)
+            except Exception:
+                # A query that sees a half-made change may fail; it is only
+                # an error if the table did not change while it ran.
+                if sequence[0] == before:
+                    raise
+                continue
+            if sequence[0] == before:
+                return result
+
+    def write(self, change: Callable[..., object], *args: object) -> object:
+        """Return change(*args, self.table), marking the table as changing
+        while it runs so that readers wait for it to finish.
+
+        Precondition: only one process writes to this table.
+        """
+
+        self._sequence[0] += 1
+        try:
+            return change(*args, self.table)
+        finally:
+            self._sequence[0] += 1
+
+    def rent_bike(self, station_id: int) -> bool:
+        """Rent a bike from the station with id station_id, as rent_bike
+        does.
+        """
+
+        return self.write(rent_bike, station_id)
+
+    def return_bike(self, station_id: int) -> bool:
+        """Return a bike to the station with id station_id, as return_bike
+        does.
+        """
+
+        return self.write(return_bike, station_id)
+
+    def apply_events(self, events: List[list]) -> BatchResult:
+        """Apply a batch of [kind, station id] events as apply_events does,
+        as one change.
+        """
+
+        return self.write(apply_events, events)
+
+
+def _read_until(name: str, deadline: float, seed: int,
+                results: multiprocessing.Queue) -> None:
+    """Look up random stations in the shared table named name until
+    deadline, checking that each has as many bikes plus docks as the first
+    time it was looked up, and put the number of lookups and of failed
+    checks on results.
+    """
+
+    shared = SharedStationTable.attach(name)
+    station_ids = list(shared.table.columns[ID])
+    sizes = {}
+    generator = random.Random(seed)
+    reads = torn = 0
+    while time.perf_counter() < deadline:
+        for _ in range(100):
+            station_id = generator.choice(station_ids)
+            _, bikes, docks, _ = shared.read(get_station_info, station_id)
+            torn += sizes.setdefault(station_id, bikes + docks) \
+                != bikes + docks
+        reads += 100
+    shared.close()
+    results.put((reads, torn))
+
+
+def _write_until(name: str, deadline: float, seed: int,
+                 results: multiprocessing.Queue) -> None:
+    """Make random rentals and returns in the shared table named name until
+    deadline, and put the number made on results.
+    """
+
+    shared = SharedStationTable.attach(name)
+    station_ids = list(shared.table.columns[ID])
+    generator = random.Random(seed)
+    writes = 0
+    while time.perf_counter() < deadline:
+        station_id = generator.choice(station_ids)
+        if generator.random() < 0.5:
+            shared.rent_bike(station_id)
+        else:
+            shared.return_bike(station_id)
+        writes += 1
+    shared.close()
+    results.put(writes)
+
+
+def benchmark(stations: List["Station"], readers: int,
+              seconds: float) -> Tuple[float, float, int]:
+    """Return the lookups per second made by readers reader processes and
+    the rentals and returns per second made by one writer process, all
+    sharing a table of stations for seconds seconds, and the number of
+    lookups that saw a station with a changed number of bikes plus docks.
+
+    >>> benchmark(SAMPLE_STATIONS, 2, 0.2)[2]
+    0
+    """
+
+    shared = SharedStationTable.create(stations)
+    results = multiprocessing.Queue()
+    deadline = time.perf_counter() + seconds
+    processes = [multiprocessing.Process(
+        target=_write_until, args=(shared.name, deadline, 0, results))]
+    processes += [multiprocessing.Process(
+        target=_read_until, args=(shared.name, deadline, seed, results))
+                  for seed in range(1, readers + 1)]
+    for process in processes:
+        process.start()
+    answers = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    shared.close()
+
+    writes = sum(answer for answer in answers if isinstance(answer, int))
+    reads = sum(answer[0] for answer in answers if isinstance(answer, tuple))
+    torn = sum(answer[1] for answer in answers if isinstance(answer, tuple))
+    return reads / seconds, writes / seconds, torn
+
+
+if __name__ == '__main__':
+    import synthetic
+
+    benchmark_stations = synthetic.synthetic_stations(100000)
+    print('{:>7} {:>12} {:>12} {:>6}'.format('readers', 'reads/s',
+                                             'writes/s', 'torn'))
+    readers = 1
+    while readers <= (os.cpu_count() or 1):
+        reads_per_second, writes_per_second, torn_reads = benchmark(
+            benchmark_stations, readers, 2.0)
+        print('{:>7} {:>12.0f} {:>12.0f} {:>6}'.format(
+            readers, reads_per_second, writes_per_second, torn_reads))
+        readers *= 2
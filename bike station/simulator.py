@@ -0,0 +1,275 @@
+"""A discrete-event simulation of trips between stations.
+
+Riders arrive at each station at random, as a Poisson process, and try to
+rent a bike with rent_bike. A rider who gets a bike rides to a nearby
+station, chosen at random with nearer stations more likely, and returns it
+there with return_bike. If that station has no free dock, the rider rides on
+to the next station nearest the first choice and tries again, until every
+possible destination has been tried, when the rider is stranded with the
+bike. Every failed rental is a stockout and every failed return is a
+full-dock event.
+
+Arrivals at all stations together are one Poisson process, so the next
+arrival is drawn once for the whole network; only bikes in transit wait in
+the heap of scheduled returns. A scenario can also redistribute bikes at a
+fixed interval, to compare redistribution policies. Times are in hours.
+
+Run this module to simulate a month of trips on stations.csv under a few
+scenarios, one process per scenario.
+"""
+
+import bisect
+import heapq
+import itertools
+import math
+import multiprocessing
+import random
+import time
+from typing import Dict, List, NamedTuple, Tuple
+
+from bikes import (ID, LATITUDE, LONGITUDE, BIKES_AVAILABLE, SAMPLE_STATIONS,
+                   StationTable, get_lat_lon_distance, get_total,
+                   plan_redistribution, redistribute_bikes, rent_bike,
+                   return_bike)
+from station_index import StationIndex
+
+# The number of trips that start at each station in an hour, on average.
+RATE = 1.0
+
+# The number of nearest stations a trip may end at.
+DESTINATIONS = 30
+
+# The average length of a trip, in kilometers. The chance that a trip ends
+# at a station falls off exponentially with its distance at this scale.
+MEAN_TRIP_KM = 2.0
+
+# The average riding speed, in kilometers per hour.
+SPEED_KMH = 15.0
+
+# The shortest time a trip takes, in hours.
+MIN_TRIP_HOURS = 2 / 60
+
+
+class Scenario(NamedTuple):
+    """The settings of one simulation: its name, how many hours it runs,
+    the trips per station per hour, how many hours apart bikes are
+    redistributed (None for never), and the random seed.
+    """
+
+    name: str
+    hours: float
+    rate: float = RATE
+    redistribute_every: float = None
+    seed: int = 0
+
+
+class SimulationResult(NamedTuple):
+    """The outcome of a simulation: the name of its scenario, the number of
+    trips completed, stockouts, full-dock events and riders stranded with
+    nowhere to return their bikes, the redistributions made and bikes they
+    moved, and how long the simulation took to run.
+    """
+
+    name: str
+    trips: int
+    stockouts: int
+    full_docks: int
+    stranded: int
+    redistributions: int
+    bikes_moved: int
+    seconds: float
+
+
+class TripSimulator:
+    """A simulation of riders taking trips between stations.
+
+    The simulator works on its own table of the stations, so the stations
+    it is given are not changed. There must be at least two stations.
+
+    >>> simulator = TripSimulator(SAMPLE_STATIONS, seed=1)
+    >>> result = simulator.run(Scenario('sample', 24.0, rate=2.0))
+    >>> result.trips + result.stockouts > 0
+    True
+    >>> bikes = get_total(BIKES_AVAILABLE, simulator.stations)
+    >>> bikes + simulator.in_transit == get_total(BIKES_AVAILABLE, \
+                                                  SAMPLE_STATIONS)
+    True
+    """
+
+    def __init__(self, stations: List["Station"], seed: int = 0) -> None:
+        """Initialize a simulator of trips between copies of the stations
+        in stations, whose random choices are seeded with seed.
+        """
+
+        self.stations = StationTable(stations)
+        self.in_transit = 0
+        self._index = StationIndex(self.stations)
+        self._station_ids = list(self.stations.column(ID))
+        self._random = random.Random(seed)
+        # The possible destinations of trips from each station, nearest
+        # first, with the cumulative weights of choosing them. Built for
+        # each station the first time a trip starts there.
+        self._destinations = {}
+
+    def _destinations_from(self, station_id: int) \
+            -> Tuple[List[int], List[float], List[float]]:
+        """Return the ids of the stations a trip from the station with id
+        station_id may end at, nearest first, their distances, and the
+        cumulative weights of choosing each.
+        """
+
+        if station_id not in self._destinations:
+            origin = self.stations[self.stations.find(station_id)]
+            lat, lon = origin[LATITUDE], origin[LONGITUDE]
+            candidates = [other_id for other_id in self._index.k_nearest(
+                lat, lon, DESTINATIONS + 1, False) if other_id != station_id]
+            distances = []
+            for other_id in candidates:
+                other = self.stations[self.stations.find(other_id)]
+                distances.append(get_lat_lon_distance(
+                    lat, lon, other[LATITUDE], other[LONGITUDE]))
+            weights = list(itertools.accumulate(
+                math.exp(-distance / MEAN_TRIP_KM) for distance in distances))
+            self._destinations[station_id] = (candidates, distances, weights)
+        return self._destinations[station_id]
+
+    def _distance(self, station_id: int, other_id: int) -> float:
+        """Return the distance in kilometers between the stations with ids
+        station_id and other_id.
+        """
+
+        station = self.stations[self.stations.find(station_id)]
+        other = self.stations[self.stations.find(other_id)]
+        return get_lat_lon_distance(station[LATITUDE], station[LONGITUDE],
+                                    other[LATITUDE], other[LONGITUDE])
+
+    def _trip_hours(self, distance: float) -> float:
+        """Return how long a trip of distance kilometers takes."""
+
+        return max(distance / SPEED_KMH, MIN_TRIP_HOURS)
+
+    def run(self, scenario: Scenario,
+            rates: Dict[int, float] = None) -> SimulationResult:
+        """Simulate scenario, starting from the current state of this
+        simulator's stations, and return its result. If rates is given, it
+        maps station ids to their trips per hour in place of scenario.rate.
+
+        Bikes still in transit when the scenario ends, and bikes of riders
+        who were stranded, are never returned, and stay counted in
+        in_transit.
+        """
+
+        began = time.perf_counter()
+        if rates is None:
+            rates = {station_id: scenario.rate
+                     for station_id in self._station_ids}
+        origins = [station_id for station_id in self._station_ids
+                   if rates.get(station_id, 0) > 0]
+        cumulative_rates = list(itertools.accumulate(
+            rates[station_id] for station_id in origins))
+        total_rate = cumulative_rates[-1] if cumulative_rates else 0.0
+
+        generator = self._random
+        stations = self.stations
+        # Each scheduled return is (time, order, station id, the number of
+        # full stations already tried, the id of the trip's first choice).
+        returns = []
+        order = itertools.count()
+        trips = stockouts = full_docks = stranded = 0
+        redistributions = bikes_moved = 0
+
+        next_arrival = generator.expovariate(total_rate) \
+            if total_rate > 0 else math.inf
+        next_redistribution = scenario.redistribute_every or math.inf
+        while True:
+            next_return = returns[0][0] if returns else math.inf
+            moment = min(next_arrival, next_return, next_redistribution)
+            if moment > scenario.hours:
+                break
+
+            if moment == next_return:
+                _, _, station_id, tries, first_id = heapq.heappop(returns)
+                if return_bike(station_id, stations):
+                    self.in_transit -= 1
+                    trips += 1
+                    continue
+                # Ride on from here to the next station nearest the first
+                # choice, unless every one of them has been tried.
+                full_docks += 1
+                candidates = self._destinations_from(first_id)[0]
+                if tries == len(candidates):
+                    stranded += 1
+                    continue
+                heapq.heappush(returns, (
+                    moment + self._trip_hours(self._distance(
+                        station_id, candidates[tries])), next(order),
+                    candidates[tries], tries + 1, first_id))
+            elif moment == next_arrival:
+                next_arrival += generator.expovariate(total_rate)
+                origin = origins[bisect.bisect(
+                    cumulative_rates, generator.random() * total_rate)]
+                if not rent_bike(origin, stations):
+                    stockouts += 1
+                    continue
+                self.in_transit += 1
+                candidates, distances, weights = \
+                    self._destinations_from(origin)
+                choice = bisect.bisect(weights,
+                                       generator.random() * weights[-1])
+                heapq.heappush(returns, (
+                    moment + self._trip_hours(distances[choice]),
+                    next(order), candidates[choice], 0, candidates[choice]))
+            else:
+                next_redistribution += scenario.redistribute_every
+                redistributions += 1
+                bikes_moved += sum(change for _, change in
+                                   plan_redistribution(stations)
+                                   if change > 0)
+                redistribute_bikes(stations)
+
+        return SimulationResult(scenario.name, trips, stockouts, full_docks,
+                                stranded, redistributions, bikes_moved,
+                                time.perf_counter() - began)
+
+
+def simulate(stations: List["Station"],
+             scenario: Scenario) -> SimulationResult:
+    """Return the result of simulating scenario on a copy of stations.
+
+    >>> simulate(SAMPLE_STATIONS, Scenario('empty', 10.0, rate=0.0)).trips
+    0
+    """
+
+    return TripSimulator(stations, scenario.seed).run(scenario)
+
+
+def run_scenarios(stations: List["Station"], scenarios: List[Scenario],
+                  processes: int = None) -> List[SimulationResult]:
+    """Return the results of simulating each scenario in scenarios on its
+    own copy of stations, running up to processes scenarios at once in
+    separate processes (by default, one per core).
+    """
+
+    with multiprocessing.Pool(processes) as pool:
+        return pool.starmap(simulate, [(stations, scenario)
+                                       for scenario in scenarios])
+
+
+if __name__ == '__main__':
+    import synthetic
+
+    month = 30 * 24.0
+    month_scenarios = [Scenario('no redistribution', month),
+                       Scenario('daily', month, redistribute_every=24.0),
+                       Scenario('every 6 hours', month,
+                                redistribute_every=6.0),
+                       Scenario('hourly', month, redistribute_every=1.0)]
+    print('{:>18} {:>9} {:>9} {:>10} {:>8} {:>8} {:>9}'.format(
+        'scenario', 'trips', 'stockouts', 'full docks', 'stranded', 'moved',
+        'seconds'))
+    for month_result in run_scenarios(synthetic.load_seed_stations(),
+                                      month_scenarios):
+        print('{:>18} {:>9} {:>9} {:>10} {:>8} {:>8} {:>9.1f}'.format(
+            month_result.name, month_result.trips, month_result.stockouts,
+            month_result.full_docks, month_result.stranded,
+            month_result.bikes_moved, month_result.seconds))
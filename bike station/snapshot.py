@@ -0,0 +1,187 @@
+"""Binary snapshots of station data that can be opened with mmap.
+
+A snapshot file stores each numeric column of a StationTable as a
+fixed-width array, followed by the station names in a single pool of UTF-8
+bytes. Opening a snapshot maps the file into memory and gives a StationTable
+whose numeric columns are memoryviews of the mapping, so nothing is parsed
+or copied, and every process that opens the same snapshot shares the same
+physical pages.
+
+The layout of a snapshot with n stations is:
+    - a header: SNAPSHOT_MAGIC, the byte order, n and the size of the
+      name pool, padded to HEADER_SIZE bytes
+    - the columns in SNAPSHOT_COLUMNS order, n items each
+    - n + 1 offsets into the name pool, where the name of the station in
+      row i is stored between offsets i and i + 1
+    - the name pool
+"""
+
+import mmap
+import struct
+import sys
+from array import array
+from typing import BinaryIO, Iterator, List
+
+from bikes import (ID, NAME, LATITUDE, LONGITUDE, CAPACITY, BIKES_AVAILABLE,
+                   DOCKS_AVAILABLE, COLUMN_TYPECODES, SAMPLE_STATIONS,
+                   StationTable)
+
+SNAPSHOT_MAGIC = b'BIKESNAP'
+HEADER = struct.Struct('<8s?xxxIQ')
+HEADER_SIZE = 32
+
+# The order of the numeric columns in a snapshot. The float columns come
+# first so that every column starts at a multiple of its item size.
+SNAPSHOT_COLUMNS = [LATITUDE, LONGITUDE, ID, CAPACITY, BIKES_AVAILABLE,
+                    DOCKS_AVAILABLE]
+
+# The typecode of the name pool offsets.
+OFFSET_TYPECODE = 'I'
+
+
+class NamePool:
+    """The NAME column of a station table opened from a snapshot. Names are
+    decoded from the snapshot when they are looked up.
+    """
+
+    def __init__(self, offsets: memoryview, pool: memoryview) -> None:
+        """Initialize a column of names, where the name in row i is stored
+        in pool between offsets[i] and offsets[i + 1].
+        """
+
+        self._offsets = offsets
+        self._pool = pool
+
+    def __len__(self) -> int:
+        """Return the number of names in this column."""
+
+        return len(self._offsets) - 1
+
+    def __getitem__(self, row: int) -> str:
+        """Return the name in row of this column."""
+
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError('name pool index out of range')
+        start, end = self._offsets[row], self._offsets[row + 1]
+        return str(self._pool[start:end], 'utf-8')
+
+    def __iter__(self) -> Iterator[str]:
+        """Return an iterator over the names in this column."""
+
+        return (self[row] for row in range(len(self)))
+
+    def release(self) -> None:
+        """Release the memoryviews this column reads its names from."""
+
+        self._offsets.release()
+        self._pool.release()
+
+
+def write_snapshot(stations: List["Station"], filename: str) -> None:
+    """Write a snapshot of the stations in stations, which may be a list or
+    a StationTable, to the file named filename.
+    """
+
+    with open(filename, 'wb') as snapshot_file:
+        write_snapshot_to(stations, snapshot_file)
+
+
+def write_snapshot_to(stations: List["Station"], snapshot_file: BinaryIO) \
+        -> None:
+    """Write a snapshot of the stations in stations, which may be a list or
+    a StationTable, to the open binary file snapshot_file.
+    """
+
+    if isinstance(stations, StationTable):
+        columns = stations.columns
+    else:
+        columns = [[station[index] for station in stations]
+                   for index in range(DOCKS_AVAILABLE + 1)]
+
+    names = [str(name).encode('utf-8') for name in columns[NAME]]
+    offsets = array(OFFSET_TYPECODE, [0])
+    for name in names:
+        offsets.append(offsets[-1] + len(name))
+
+    header = HEADER.pack(SNAPSHOT_MAGIC, sys.byteorder == 'little',
+                         len(names), offsets[-1])
+    snapshot_file.write(header.ljust(HEADER_SIZE, b'\0'))
+    for index in SNAPSHOT_COLUMNS:
+        column = columns[index]
+        if not isinstance(column, array):
+            column = array(COLUMN_TYPECODES[index], column)
+        snapshot_file.write(column.tobytes())
+    snapshot_file.write(offsets.tobytes())
+    snapshot_file.write(b''.join(names))
+
+
+def open_snapshot(filename: str,
+                  access: int = mmap.ACCESS_READ) -> StationTable:
+    """Return a StationTable of the stations in the snapshot file named
+    filename, backed by a memory map of the file opened with access.
+
+    With the default mmap.ACCESS_READ the table is read-only. Use
+    mmap.ACCESS_COPY for a table that can be changed without changing the
+    file, or mmap.ACCESS_WRITE to write changes through to the file. In
+    every case the table cannot grow or shrink.
+
+    >>> import os, tempfile
+    >>> filename = os.path.join(tempfile.mkdtemp(), 'stations.snap')
+    >>> write_snapshot(SAMPLE_STATIONS, filename)
+    >>> table = open_snapshot(filename)
+    >>> table.to_list() == SAMPLE_STATIONS
+    True
+    >>> table[table.find(7571)][NAME]
+    'Highfield Rd / Gerrard St E - SMART'
+    >>> copy = open_snapshot(filename, mmap.ACCESS_COPY)
+    >>> copy[0][BIKES_AVAILABLE] = 0
+    >>> open_snapshot(filename)[0][BIKES_AVAILABLE]
+    4
+    """
+
+    mode = 'r+b' if access == mmap.ACCESS_WRITE else 'rb'
+    with open(filename, mode) as snapshot_file:
+        memory = mmap.mmap(snapshot_file.fileno(), 0, access=access)
+
+    return table_from_buffer(memory, filename,
+                             shared=access == mmap.ACCESS_WRITE)
+
+
+def table_from_buffer(buffer: object, name: str = 'buffer',
+                      shared: bool = False) -> StationTable:
+    """Return a StationTable of the stations in the snapshot held in buffer,
+    an object supporting the buffer protocol, without copying them. name
+    describes buffer in error messages.
+
+    If shared is True, the table's columns may be changed by others while it
+    is in use, as described in StationTable.from_columns.
+
+    >>> import io
+    >>> snapshot_file = io.BytesIO()
+    >>> write_snapshot_to(SAMPLE_STATIONS, snapshot_file)
+    >>> table = table_from_buffer(snapshot_file.getbuffer())
+    >>> table.to_list() == SAMPLE_STATIONS
+    True
+    """
+
+    magic, little_endian, count, pool_size = HEADER.unpack_from(buffer)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError('{} is not a station snapshot'.format(name))
+    if little_endian != (sys.byteorder == 'little'):
+        raise ValueError('{} was written with a different byte order'.format(
+            name))
+
+    view = memoryview(buffer)
+    columns = [None] * (DOCKS_AVAILABLE + 1)
+    start = HEADER_SIZE
+    for index in SNAPSHOT_COLUMNS:
+        typecode = COLUMN_TYPECODES[index]
+        end = start + count * array(typecode).itemsize
+        columns[index] = view[start:end].cast(typecode)
+        start = end
+    end = start + (count + 1) * array(OFFSET_TYPECODE).itemsize
+    offsets = view[start:end].cast(OFFSET_TYPECODE)
+    columns[NAME] = NamePool(offsets, view[end:end + pool_size])
+    return StationTable.from_columns(columns, shared)
@@ -0,0 +1,267 @@
+"""A graph of the stations within riding distance of each other.
+
+Two stations are connected if get_lat_lon_distance puts them at most a
+given radius apart, and the connection is weighted by that distance. The
+graph is stored in compressed sparse row (CSR) form: the neighbours of the
+station at each position are targets[offsets[position]:offsets[position +
+1]], with their distances at the same places in distances. Three flat
+arrays take far less memory than a list per station, so a graph of 100,000
+stations and millions of connections fits easily.
+
+To find the connections, stations are put in cubic cells, as wide as the
+radius, by their positions on the unit sphere (see station_index), so each
+station is only compared with the stations in its own and the neighbouring
+cells, and each pair is compared once. The graph answers which stations are
+reachable in a number of hops, the shortest route between two stations
+(Dijkstra's algorithm, with a heap), and which groups of stations are
+connected at all.
+
+Run this module to build a graph of 100,000 synthetic stations and time
+some queries.
+"""
+
+import heapq
+import itertools
+import math
+from array import array
+from typing import List, Tuple
+
+from bikes import (ID, LATITUDE, LONGITUDE, SAMPLE_STATIONS,
+                   get_lat_lon_distance)
+from station_index import ROUNDING_SLACK, distance_to_chord, to_unit_vector
+
+# The offsets of the cells that come after a cell, in the order of their
+# coordinates. A station is compared with the later stations in its own
+# cell and every station in these cells, so each pair is compared once.
+_LATER_CELLS = [offset for offset in itertools.product((-1, 0, 1), repeat=3)
+                if offset > (0, 0, 0)]
+
+
+class StationGraph:
+    """A graph connecting the stations at most radius kilometers apart.
+
+    The graph is a copy: it does not change when the stations do.
+
+    >>> graph = StationGraph(SAMPLE_STATIONS, 2.45)
+    >>> graph.neighbours(7090)
+    [(7571, 1.197), (7486, 2.435)]
+    >>> graph.within_hops(7486, 1), graph.within_hops(7486, 2)
+    ([7090], [7090, 7571])
+    >>> graph.shortest_path(7486, 7571)
+    (3.632, [7486, 7090, 7571])
+    >>> StationGraph(SAMPLE_STATIONS, 1.5).components()
+    [[7090, 7571], [7486]]
+    """
+
+    def __init__(self, stations: List["Station"], radius: float) -> None:
+        """Initialize a graph of the stations in stations, connecting each
+        pair at most radius kilometers apart.
+
+        Precondition: no two stations in stations have the same id.
+        """
+
+        self.radius = radius
+        self.station_ids = array('i', (station[ID] for station in stations))
+        self._position_of = {station_id: position for position, station_id
+                             in enumerate(self.station_ids)}
+        neighbours, distances = self._connect(
+            [station[LATITUDE] for station in stations],
+            [station[LONGITUDE] for station in stations])
+        self.offsets = array('q', itertools.accumulate(
+            map(len, neighbours), initial=0))
+        self.targets = array('i', itertools.chain.from_iterable(neighbours))
+        self.distances = array('d', itertools.chain.from_iterable(distances))
+
+    def _connect(self, lats: List[float], lons: List[float]) \
+            -> Tuple[List[List[int]], List[array]]:
+        """Return the positions of the neighbours of the station at each
+        position, whose location is (lats[position], lons[position]), and
+        their distances from it.
+        """
+
+        radius = self.radius
+        size = distance_to_chord(radius + ROUNDING_SLACK)
+        limit = size * size
+        vectors = list(map(to_unit_vector, lats, lons))
+        cells = {}
+        for position, (x, y, z) in enumerate(vectors):
+            cells.setdefault((math.floor(x / size), math.floor(y / size),
+                              math.floor(z / size)), []).append(position)
+
+        neighbours = [[] for _ in vectors]
+        distances = [array('d') for _ in vectors]
+        for (x, y, z), members in cells.items():
+            nearby = list(members)
+            for dx, dy, dz in _LATER_CELLS:
+                nearby += cells.get((x + dx, y + dy, z + dz), ())
+            nearby_vectors = [vectors[position] for position in nearby]
+            for rank, position in enumerate(members, 1):
+                px, py, pz = vectors[position]
+                # Compare the cheap straight-line distances first, and
+                # only compute get_lat_lon_distance for the stations left.
+                close = [other for other, (ox, oy, oz) in
+                         zip(nearby[rank:], nearby_vectors[rank:])
+                         if (px - ox) ** 2 + (py - oy) ** 2
+                         + (pz - oz) ** 2 <= limit]
+                lat, lon = lats[position], lons[position]
+                for other, distance in zip(close, map(
+                        get_lat_lon_distance, itertools.repeat(lat),
+                        itertools.repeat(lon), map(lats.__getitem__, close),
+                        map(lons.__getitem__, close))):
+                    if distance <= radius:
+                        neighbours[position].append(other)
+                        distances[position].append(distance)
+                        neighbours[other].append(position)
+                        distances[other].append(distance)
+        return neighbours, distances
+
+    def __len__(self) -> int:
+        """Return the number of stations in this graph."""
+
+        return len(self.station_ids)
+
+    def edge_count(self) -> int:
+        """Return the number of pairs of connected stations."""
+
+        return len(self.targets) // 2
+
+    def _position(self, station_id: int) -> int:
+        """Return the position of the station with id station_id, raising
+        KeyError if it is not in this graph.
+        """
+
+        return self._position_of[station_id]
+
+    def neighbours(self, station_id: int) -> List[Tuple[int, float]]:
+        """Return a list of (id, distance in kilometers) pairs for the
+        stations connected to the station with id station_id, nearest
+        first. Stations at the same distance are ordered as they appear in
+        the stations list.
+        """
+
+        position = self._position(station_id)
+        start, end = self.offsets[position], self.offsets[position + 1]
+        return [(self.station_ids[other], distance) for distance, other in
+                sorted(zip(self.distances[start:end],
+                           self.targets[start:end]))]
+
+    def within_hops(self, station_id: int, hops: int) -> List[int]:
+        """Return the ids of the stations, other than the station with id
+        station_id, that can be reached from it in at most hops hops, in
+        the order they are first reached.
+        """
+
+        offsets, targets = self.offsets, self.targets
+        start = self._position(station_id)
+        seen = {start}
+        reached = []
+        frontier = [start]
+        for _ in range(hops):
+            found = []
+            for position in frontier:
+                for other in targets[offsets[position]:offsets[position + 1]]:
+                    if other not in seen:
+                        seen.add(other)
+                        found.append(other)
+            if not found:
+                break
+            reached += found
+            frontier = found
+        return [self.station_ids[position] for position in reached]
+
+    def shortest_path(self, source_id: int,
+                      target_id: int) -> Tuple[float, List[int]]:
+        """Return the length in kilometers, rounded to the nearest metre, of
+        the shortest route from the station with id source_id to the
+        station with id target_id that only rides between connected
+        stations, and the ids of the stations along it. Return (math.inf,
+        []) if there is no such route.
+        """
+
+        offsets, targets, distances = \
+            self.offsets, self.targets, self.distances
+        source = self._position(source_id)
+        target = self._position(target_id)
+        best = {source: 0.0}
+        previous = {}
+        pending = [(0.0, source)]
+        while pending:
+            length, position = heapq.heappop(pending)
+            if position == target:
+                path = [position]
+                while path[-1] != source:
+                    path.append(previous[path[-1]])
+                return round(length, 3), [self.station_ids[position]
+                                          for position in reversed(path)]
+            if length > best[position]:
+                continue
+            start, end = offsets[position], offsets[position + 1]
+            for other, distance in zip(targets[start:end],
+                                       distances[start:end]):
+                total = length + distance
+                if total < best.get(other, math.inf):
+                    best[other] = total
+                    previous[other] = position
+                    heapq.heappush(pending, (total, other))
+        return math.inf, []
+
+    def components(self) -> List[List[int]]:
+        """Return the ids of the stations in each group of stations that
+        are connected to each other by some route, largest group first.
+        Groups of the same size, and the stations in each group, are
+        ordered as they appear in the stations list.
+        """
+
+        offsets, targets = self.offsets, self.targets
+        component_of = array('i', [-1]) * len(self)
+        groups = []
+        for start in range(len(self)):
+            if component_of[start] != -1:
+                continue
+            component_of[start] = len(groups)
+            group = [start]
+            frontier = [start]
+            while frontier:
+                found = []
+                for position in frontier:
+                    for other in targets[offsets[position]:
+                                         offsets[position + 1]]:
+                        if component_of[other] == -1:
+                            component_of[other] = len(groups)
+                            found.append(other)
+                group += found
+                frontier = found
+            groups.append(group)
+        groups.sort(key=len, reverse=True)
+        return [[self.station_ids[position] for position in sorted(group)]
+                for group in groups]
+
+
+if __name__ == '__main__':
+    import random
+    import time
+
+    import synthetic
+
+    graph_stations = synthetic.synthetic_stations(100000)
+    began = time.perf_counter()
+    station_graph = StationGraph(graph_stations, 0.1)
+    print('{} stations, {} connections within {} km, built in {:.1f}s'.format(
+        len(station_graph), station_graph.edge_count(), station_graph.radius,
+        time.perf_counter() - began))
+
+    generator = random.Random(0)
+    graph_ids = list(station_graph.station_ids)
+    for description, query in [
+            ('3 hops', lambda: station_graph.within_hops(
+                generator.choice(graph_ids), 3)),
+            ('shortest path', lambda: station_graph.shortest_path(
+                generator.choice(graph_ids), generator.choice(graph_ids))),
+            ('components', station_graph.components)]:
+        began = time.perf_counter()
+        calls = 0
+        while time.perf_counter() - began < 1.0:
+            query()
+            calls += 1
+        print('{:>14}: {:.4f}s per query'.format(
+            description, (time.perf_counter() - began) / calls))
@@ -0,0 +1,431 @@
+"""A spatial index over bike stations for fast nearest-station queries.
+
+Stations are stored in a k-d tree over their positions on the unit sphere,
+so that a query only computes get_lat_lon_distance for the handful of
+stations close to the query point instead of every station in the list.
+Answers are always identical to a linear scan over the stations list: the
+same rounded distances are compared, and ties go to the station that
+appears first in the list.
+
+Queries may also ask for stations with at least some bikes or docks
+available. The index keeps the station lists (or StationTable rows) it was
+given, so these counts are read live as the search reaches each station:
+the search skips stations without enough bikes or docks and carries on
+outwards, still pruning every branch that is too far away to matter.
+"""
+
+import heapq
+import math
+from typing import List, Tuple
+
+from bikes import (ID, LATITUDE, LONGITUDE, BIKES_AVAILABLE,
+                   DOCKS_AVAILABLE, EARTH_RADIUS, SAMPLE_STATIONS,
+                   get_lat_lon_distance, has_kiosk)
+
+# The number of stations a leaf holds before it is split in two.
+LEAF_SIZE = 8
+
+# get_lat_lon_distance rounds to the nearest metre, so a station whose exact
+# distance is within half a metre of the best one may still tie it.
+ROUNDING_SLACK = 0.0005 + 1e-9
+
+
+def to_unit_vector(lat: float, lon: float) -> Tuple[float, float, float]:
+    """Return the (x, y, z) position of the location (lat, lon) on the unit
+    sphere.
+
+    >>> to_unit_vector(0.0, 0.0)
+    (1.0, 0.0, 0.0)
+    >>> to_unit_vector(90.0, 0.0)[2]
+    1.0
+    """
+
+    lat, lon = math.radians(lat), math.radians(lon)
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon),
+            math.sin(lat))
+
+
+def chord_to_distance(chord: float) -> float:
+    """Return the distance in kilometers along the surface of the earth
+    between two locations whose unit vectors are chord apart.
+
+    >>> round(chord_to_distance(math.sqrt(2)), 3)
+    10007.543
+    """
+
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, chord / 2))
+
+
+def distance_to_chord(distance: float) -> float:
+    """Return the distance between the unit vectors of two locations that
+    are distance kilometers apart along the surface of the earth.
+
+    >>> round(distance_to_chord(chord_to_distance(0.5)), 6)
+    0.5
+    """
+
+    return 2 * math.sin(min(math.pi / 2, distance / (2 * EARTH_RADIUS)))
+
+
+class _Node:
+    """A node of the k-d tree. Leaves have a list of station positions in
+    points; internal nodes split on coordinate axis at value split, with
+    positions below split in left and positions at or above it in right.
+    """
+
+    __slots__ = ('axis', 'split', 'left', 'right', 'points')
+
+
+class StationIndex:
+    """A spatial index of stations answering nearest-station queries.
+
+    Each station is given a position in the order it was added, so the
+    index must be built from the stations list and then kept in step with
+    it: add a station when it is appended to the list, and remove it when
+    it is removed from the list.
+
+    >>> index = StationIndex(SAMPLE_STATIONS)
+    >>> index.nearest(43.671134, -79.325164, False)
+    7571
+    >>> index.nearest(43.671134, -79.325164, True)
+    7090
+    >>> index.k_nearest(43.671134, -79.325164, 2, False)
+    [7571, 7090]
+    >>> index.remove(7571)
+    True
+    >>> index.nearest(43.671134, -79.325164, False)
+    7090
+    >>> index.add(SAMPLE_STATIONS[2])
+    >>> index.nearest(43.671134, -79.325164, False)
+    7571
+    """
+
+    def __init__(self, stations: List["Station"]) -> None:
+        """Initialize a new index containing the stations in stations."""
+
+        self._ids = []
+        self._stations = []
+        self._lats = []
+        self._lons = []
+        self._kiosks = []
+        self._vectors = []
+        self._position_of = {}
+        self._leaf_of = {}
+        for station in stations:
+            self._store(station)
+        self._root = self._build(list(range(len(self._ids))), _Node())
+
+    def __len__(self) -> int:
+        """Return the number of stations in this index."""
+
+        return len(self._position_of)
+
+    def __contains__(self, station_id: int) -> bool:
+        """Return True if and only if the station with id station_id is in
+        this index.
+        """
+
+        return station_id in self._position_of
+
+    def add(self, station: "Station") -> None:
+        """Add station to this index, as if it were appended to the end of
+        the stations list.
+
+        Precondition: no station with the same id is in this index.
+        """
+
+        position = self._store(station)
+        vector = self._vectors[position]
+        node = self._root
+        while node.points is None:
+            if vector[node.axis] < node.split:
+                node = node.left
+            else:
+                node = node.right
+        node.points.append(position)
+        self._leaf_of[position] = node
+        if len(node.points) > 2 * LEAF_SIZE:
+            self._build(node.points, node)
+
+    def remove(self, station_id: int) -> bool:
+        """Remove the station with id station_id from this index. Return True
+        if and only if that station was in this index.
+        """
+
+        if station_id not in self._position_of:
+            return False
+
+        position = self._position_of.pop(station_id)
+        self._leaf_of.pop(position).points.remove(position)
+        return True
+
+    def nearest(self, lat: float, lon: float, with_kiosk: bool) -> int:
+        """Return the id of the station in this index that is nearest to the
+        location (lat, lon), with the same result as get_nearest_station. If
+        with_kiosk is True, return the id of the closest station with a
+        kiosk. Return -1 if there is no such station.
+        """
+
+        nearest = self._search(lat, lon, 1, with_kiosk)
+        if not nearest:
+            return -1
+        return self._ids[nearest[0][1]]
+
+    def k_nearest(self, lat: float, lon: float, k: int,
+                  with_kiosk: bool) -> List[int]:
+        """Return the ids of the k stations in this index that are nearest to
+        the location (lat, lon), nearest first. If with_kiosk is True, only
+        include stations with a kiosk. Stations at the same distance are
+        ordered as they appear in the stations list.
+
+        Precondition: k >= 0
+        """
+
+        return [self._ids[position]
+                for _, position in self._search(lat, lon, k, with_kiosk)]
+
+    def nearest_available(self, lat: float, lon: float,
+                          with_kiosk: bool = False, min_bikes: int = 0,
+                          min_docks: int = 0) -> int:
+        """Return the id of the station in this index nearest to the location
+        (lat, lon) that has at least min_bikes bikes and at least min_docks
+        docks available right now, and a kiosk if with_kiosk is True.
+        Return -1 if there is no such station.
+
+        >>> stations = [station[:] for station in SAMPLE_STATIONS]
+        >>> index = StationIndex(stations)
+        >>> index.nearest_available(43.671134, -79.325164, min_bikes=15)
+        -1
+        >>> index.nearest_available(43.671134, -79.325164, min_docks=11)
+        7486
+        >>> stations[0][DOCKS_AVAILABLE] = 11
+        >>> index.nearest_available(43.671134, -79.325164, min_docks=11)
+        7090
+        """
+
+        nearest = self._search(lat, lon, 1, with_kiosk, min_bikes, min_docks)
+        if not nearest:
+            return -1
+        return self._ids[nearest[0][1]]
+
+    def k_nearest_available(self, lat: float, lon: float, k: int,
+                            with_kiosk: bool = False, min_bikes: int = 0,
+                            min_docks: int = 0) -> List[Tuple[int, float]]:
+        """Return a list of (id, distance in kilometers) pairs for the k
+        stations in this index nearest to the location (lat, lon) that have
+        at least min_bikes bikes and min_docks docks available right now,
+        and a kiosk if with_kiosk is True, nearest first. Stations at the
+        same distance are ordered as they appear in the stations list.
+
+        Precondition: k >= 0
+
+        >>> index = StationIndex(SAMPLE_STATIONS)
+        >>> index.k_nearest_available(43.671134, -79.325164, 2, min_bikes=5)
+        [(7571, 0.061), (7486, 2.539)]
+        """
+
+        return [(self._ids[position], distance) for distance, position in
+                self._search(lat, lon, k, with_kiosk, min_bikes, min_docks)]
+
+    def stations_within(self, lat: float, lon: float, radius: float,
+                        with_kiosk: bool = False) -> List[Tuple[int, float]]:
+        """Return a list of (id, distance in kilometers) pairs for the
+        stations in this index at most radius kilometers from the location
+        (lat, lon), with a kiosk if with_kiosk is True, nearest first.
+        Stations at the same distance are ordered as they appear in the
+        stations list.
+
+        >>> index = StationIndex(SAMPLE_STATIONS)
+        >>> index.stations_within(43.671134, -79.325164, 1.5)
+        [(7571, 0.061), (7090, 1.256)]
+        >>> index.stations_within(43.671134, -79.325164, 1.5, True)
+        [(7090, 1.256)]
+        """
+
+        return [(self._ids[position], distance) for distance, position in
+                sorted(self._within(lat, lon, radius, with_kiosk))]
+
+    def stations_within_many(self, locations: List[Tuple[float, float]],
+                             radius: float, with_kiosk: bool = False) \
+            -> List[List[Tuple[int, float]]]:
+        """Return a list holding, for each (latitude, longitude) location in
+        locations, the result of stations_within for that location.
+
+        >>> index = StationIndex(SAMPLE_STATIONS)
+        >>> index.stations_within_many([(43.671134, -79.325164), \
+                                        (43.684261, -79.299332)], 0.5)
+        [[(7571, 0.061)], [(7486, 0.0)]]
+        """
+
+        return [self.stations_within(lat, lon, radius, with_kiosk)
+                for lat, lon in locations]
+
+    def stations_in_bbox(self, min_lat: float, min_lon: float,
+                         max_lat: float, max_lon: float,
+                         with_kiosk: bool = False) -> List[Tuple[int, float]]:
+        """Return a list of (id, distance in kilometers) pairs for the
+        stations in this index with a latitude from min_lat to max_lat and
+        a longitude from min_lon to max_lon, with a kiosk if with_kiosk is
+        True. They are ordered by their distance from the centre of the box
+        and then as they appear in the stations list.
+
+        Precondition: min_lat <= max_lat and min_lon <= max_lon, and the box
+        is less than half the earth wide.
+
+        >>> index = StationIndex(SAMPLE_STATIONS)
+        >>> index.stations_in_bbox(43.67, -79.33, 43.69, -79.32)
+        [(7090, 0.421), (7571, 0.925)]
+        """
+
+        lat = (min_lat + max_lat) / 2
+        lon = (min_lon + max_lon) / 2
+        # The circle through the corners and the middles of the edges
+        # contains the box, which is small next to the earth.
+        radius = max(get_lat_lon_distance(lat, lon, corner_lat, corner_lon)
+                     for corner_lat in [min_lat, lat, max_lat]
+                     for corner_lon in [min_lon, lon, max_lon])
+        lats, lons = self._lats, self._lons
+        return [(self._ids[position], distance) for distance, position in
+                sorted(self._within(lat, lon, radius * 1.01 + 0.001,
+                                    with_kiosk))
+                if min_lat <= lats[position] <= max_lat
+                and min_lon <= lons[position] <= max_lon]
+
+    def _store(self, station: "Station") -> int:
+        """Record the data this index needs about station and return the
+        position it was given.
+        """
+
+        position = len(self._ids)
+        self._ids.append(station[ID])
+        self._stations.append(station)
+        self._lats.append(station[LATITUDE])
+        self._lons.append(station[LONGITUDE])
+        self._kiosks.append(has_kiosk(station))
+        self._vectors.append(to_unit_vector(station[LATITUDE],
+                                            station[LONGITUDE]))
+        self._position_of[station[ID]] = position
+        return position
+
+    def _build(self, positions: List[int], node: _Node) -> _Node:
+        """Turn node into the root of a subtree holding the stations at
+        positions, and return it.
+        """
+
+        if len(positions) <= LEAF_SIZE:
+            node.points = positions
+            for position in positions:
+                self._leaf_of[position] = node
+            return node
+
+        vectors = self._vectors
+        spreads = []
+        for axis in range(3):
+            values = [vectors[position][axis] for position in positions]
+            spreads.append(max(values) - min(values))
+        axis = spreads.index(max(spreads))
+
+        positions = sorted(positions, key=lambda p: vectors[p][axis])
+        middle = len(positions) // 2
+        node.points = None
+        node.axis = axis
+        node.split = vectors[positions[middle]][axis]
+        node.left = self._build(positions[:middle], _Node())
+        node.right = self._build(positions[middle:], _Node())
+        return node
+
+    def _within(self, lat: float, lon: float, radius: float,
+                with_kiosk: bool) -> List[Tuple[float, int]]:
+        """Return an unsorted list of (distance, position) pairs for the
+        stations at most radius kilometers from (lat, lon), with a kiosk if
+        with_kiosk is True.
+
+        Branches of the tree farther away than radius are skipped, and each
+        station left is first checked against radius by its straight-line
+        distance through the earth, which is far cheaper than
+        get_lat_lon_distance.
+        """
+
+        query = to_unit_vector(lat, lon)
+        limit = radius + ROUNDING_SLACK
+        chord_squared = distance_to_chord(limit) ** 2
+        lats, lons, kiosks = self._lats, self._lons, self._kiosks
+        vectors = self._vectors
+        found = []
+        pending = [self._root]
+        while pending:
+            node = pending.pop()
+            if node.points is not None:
+                for position in node.points:
+                    if with_kiosk and not kiosks[position]:
+                        continue
+                    x, y, z = vectors[position]
+                    if (x - query[0]) ** 2 + (y - query[1]) ** 2 \
+                            + (z - query[2]) ** 2 > chord_squared:
+                        continue
+                    distance = get_lat_lon_distance(
+                        lats[position], lons[position], lat, lon)
+                    if distance <= radius:
+                        found.append((distance, position))
+                continue
+
+            offset = query[node.axis] - node.split
+            if offset < 0:
+                near, far = node.left, node.right
+            else:
+                near, far = node.right, node.left
+            pending.append(near)
+            if chord_to_distance(abs(offset)) <= limit:
+                pending.append(far)
+        return found
+
+    def _search(self, lat: float, lon: float, k: int, with_kiosk: bool,
+                min_bikes: int = 0,
+                min_docks: int = 0) -> List[Tuple[float, int]]:
+        """Return a list of (distance, position) pairs for the k eligible
+        stations nearest to (lat, lon), sorted by distance and then by
+        position. A station is eligible if it has a kiosk or with_kiosk is
+        False, and it has at least min_bikes bikes and min_docks docks
+        available.
+        """
+
+        if k <= 0:
+            return []
+
+        query = to_unit_vector(lat, lon)
+        lats, lons, kiosks = self._lats, self._lons, self._kiosks
+        stations = self._stations
+        constrained = min_bikes > 0 or min_docks > 0
+        # A heap of (-distance, -position), so the worst candidate is first.
+        best = []
+        pending = [(self._root, 0.0)]
+        while pending:
+            node, bound = pending.pop()
+            if len(best) == k and bound > -best[0][0] + ROUNDING_SLACK:
+                continue
+            if node.points is not None:
+                for position in node.points:
+                    if with_kiosk and not kiosks[position]:
+                        continue
+                    if constrained and (
+                            stations[position][BIKES_AVAILABLE] < min_bikes
+                            or stations[position][DOCKS_AVAILABLE]
+                            < min_docks):
+                        continue
+                    candidate = (-get_lat_lon_distance(
+                        lats[position], lons[position], lat, lon), -position)
+                    if len(best) < k:
+                        heapq.heappush(best, candidate)
+                    elif candidate > best[0]:
+                        heapq.heapreplace(best, candidate)
+                continue
+
+            offset = query[node.axis] - node.split
+            if offset < 0:
+                near, far = node.left, node.right
+            else:
+                near, far = node.right, node.left
+            pending.append((far, max(bound, chord_to_distance(abs(offset)))))
+            pending.append((near, bound))
+
+        return sorted((-distance, -position) for distance, position in best)
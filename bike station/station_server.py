@@ -0,0 +1,348 @@
+"""An asyncio server for station queries and transactions.
+
+The server speaks a line protocol over TCP: each request is one line holding
+a JSON object with an "op" and its arguments, and each response is one line
+holding a JSON object with a "result" (or an "error"). If a request has an
+"id", its response has the same "id". Clients may send many requests
+without waiting for responses (pipelining), and responses on a connection
+always come back in the order the requests were sent.
+
+The requests are:
+    {"op": "info", "station_id": int}          -> get_station_info
+    {"op": "nearest", "lat": float, "lon": float, "with_kiosk": bool}
+                                               -> get_nearest_station
+    {"op": "rent", "station_id": int}          -> rent_bike
+    {"op": "return", "station_id": int}        -> return_bike
+    {"op": "docks", "n": int}                  -> get_stations_with_n_docks
+
+Everything runs on one event loop, so no locks are needed. Nearest-station
+requests that arrive together, from any connection, are answered by one
+callback rather than one per request; each distinct location is still its
+own StationIndex search, but a location asked for more than once in the
+same round is only searched once.
+
+Run this module with "serve" to start a server on stations.csv, or with
+"load" to measure latency and throughput against a local server.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Dict, List, Tuple
+
+from bikes import (ID, LATITUDE, LONGITUDE, SAMPLE_STATIONS, StationTable,
+                   get_station_info, get_stations_with_n_docks,
+                   read_station_table, rent_bike, return_bike)
+from station_index import StationIndex
+
+HOST = '127.0.0.1'
+PORT = 8108
+
+# The most requests from one connection that may be waiting for responses.
+MAX_PIPELINE = 256
+
+
+class StationService:
+    """Answers requests about a table of stations.
+
+    >>> service = StationService(SAMPLE_STATIONS)
+    >>> asyncio.run(service.handle({'op': 'info', 'station_id': 7090}))
+    ['Danforth Ave / Lamb Ave', 4, 10, True]
+    >>> asyncio.run(service.handle({'op': 'nearest', 'lat': 43.671134, \
+                                    'lon': -79.325164, 'with_kiosk': True}))
+    7090
+    >>> asyncio.run(service.handle({'op': 'rent', 'station_id': 7090}))
+    True
+    >>> asyncio.run(service.handle({'op': 'docks', 'n': 11}))
+    [7090, 7486]
+    """
+
+    def __init__(self, stations: List["Station"]) -> None:
+        """Initialize a service for a table of the stations in stations."""
+
+        self.stations = StationTable(stations)
+        self._index = StationIndex(self.stations)
+        self._pending_nearest = []
+        self._connections = set()
+        self.nearest_rounds = 0
+
+    async def handle(self, request: Dict[str, object]) -> object:
+        """Return the result of request."""
+
+        op = request['op']
+        if op == 'nearest':
+            # Convert here, so a bad location is reported to its own
+            # client instead of failing while the round is answered.
+            return await self._nearest(float(request['lat']),
+                                       float(request['lon']),
+                                       bool(request.get('with_kiosk', False)))
+        if op == 'info':
+            return get_station_info(request['station_id'], self.stations)
+        if op == 'rent':
+            return rent_bike(request['station_id'], self.stations)
+        if op == 'return':
+            return return_bike(request['station_id'], self.stations)
+        if op == 'docks':
+            return get_stations_with_n_docks(request['n'], self.stations)
+        raise ValueError('unknown op {!r}'.format(op))
+
+    def _nearest(self, lat: float, lon: float,
+                 with_kiosk: bool) -> asyncio.Future:
+        """Return a future for the nearest station to (lat, lon), which is
+        answered along with every other nearest-station request made before
+        the event loop next runs its callbacks.
+        """
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if not self._pending_nearest:
+            loop.call_soon(self._answer_nearest)
+        self._pending_nearest.append((lat, lon, with_kiosk, future))
+        return future
+
+    def _answer_nearest(self) -> None:
+        """Answer every waiting nearest-station request, searching once for
+        each distinct query. A query that fails has its error set on its
+        own futures only.
+        """
+
+        pending, self._pending_nearest = self._pending_nearest, []
+        self.nearest_rounds += 1
+        nearest = self._index.nearest
+        answers = {}
+        for lat, lon, with_kiosk, future in pending:
+            if future.cancelled():
+                continue
+            query = (lat, lon, with_kiosk)
+            if query not in answers:
+                try:
+                    answers[query] = (nearest(lat, lon, with_kiosk), None)
+                except Exception as error:
+                    answers[query] = (None, error)
+            result, error = answers[query]
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    async def serve_connection(self, reader: asyncio.StreamReader,
+                               writer: asyncio.StreamWriter) -> None:
+        """Answer the requests sent on a connection, in order, until the
+        client closes it.
+        """
+
+        self._connections.add(asyncio.current_task())
+        responses = asyncio.Queue(MAX_PIPELINE)
+        sender = asyncio.ensure_future(_send_responses(responses, writer))
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                await responses.put(asyncio.ensure_future(
+                    self._respond(line)))
+        finally:
+            await responses.put(None)
+            await sender
+            writer.close()
+            self._connections.discard(asyncio.current_task())
+
+    async def wait_closed(self) -> None:
+        """Wait until every connection to this service has been closed."""
+
+        await asyncio.gather(*self._connections)
+
+    async def _respond(self, line: bytes) -> bytes:
+        """Return the response line to the request line line.
+
+        >>> service = StationService(SAMPLE_STATIONS)
+        >>> asyncio.run(service._respond(
+        ...     b'{"id": 1, "op": "nearest", "lat": "x", "lon": 1}'))
+        b'{"id": 1, "error": "could not convert string to float: \\'x\\'"}\\n'
+        """
+
+        response = {}
+        try:
+            request = json.loads(line)
+            if 'id' in request:
+                response['id'] = request['id']
+            response['result'] = await self.handle(request)
+        except (ValueError, KeyError, TypeError) as error:
+            response['error'] = str(error)
+        return json.dumps(response).encode() + b'\n'
+
+
+async def _send_responses(responses: asyncio.Queue,
+                          writer: asyncio.StreamWriter) -> None:
+    """Write the responses from responses to writer in order, until a None
+    is taken from responses.
+    """
+
+    while True:
+        response = await responses.get()
+        if response is None:
+            break
+        writer.write(await response)
+        if responses.empty():
+            await writer.drain()
+
+
+async def start_server(service: StationService, host: str = HOST,
+                       port: int = PORT) -> asyncio.AbstractServer:
+    """Start serving service on host and port, and return the server."""
+
+    return await asyncio.start_server(service.serve_connection, host, port)
+
+
+async def run_load(host: str, port: int, clients: int, requests: int,
+                   pipeline: int, stations: List["Station"],
+                   seed: int = 0) -> Dict[str, float]:
+    """Run clients clients against the server at host and port, each
+    sending requests random requests about stations with up to pipeline
+    requests waiting at once, and return a dict of the number of requests,
+    the requests per second, and the 50th and 99th percentile latencies in
+    milliseconds.
+
+    >>> async def check():
+    ...     service = StationService(SAMPLE_STATIONS)
+    ...     server = await start_server(service, port=0)
+    ...     port = server.sockets[0].getsockname()[1]
+    ...     results = await run_load(HOST, port, 4, 50, 8, SAMPLE_STATIONS)
+    ...     server.close()
+    ...     await service.wait_closed()
+    ...     return results['requests']
+    >>> asyncio.run(check())
+    200
+    """
+
+    generator = random.Random(seed)
+    station_ids = [station[ID] for station in stations]
+    latitudes = [station[LATITUDE] for station in stations]
+    longitudes = [station[LONGITUDE] for station in stations]
+
+    def make_request(request_id: int) -> Dict[str, object]:
+        """Return a random request with id request_id."""
+
+        op = generator.choice(['info', 'nearest', 'nearest', 'rent',
+                               'return', 'docks'])
+        request = {'id': request_id, 'op': op}
+        if op == 'nearest':
+            request['lat'] = generator.uniform(min(latitudes), max(latitudes))
+            request['lon'] = generator.uniform(min(longitudes),
+                                               max(longitudes))
+            request['with_kiosk'] = generator.random() < 0.5
+        elif op == 'docks':
+            request['n'] = generator.randint(0, 30)
+        else:
+            request['station_id'] = generator.choice(station_ids)
+        return request
+
+    latencies = []
+
+    async def client(number: int) -> None:
+        """Send requests requests, keeping up to pipeline of them waiting."""
+
+        reader, writer = await asyncio.open_connection(host, port)
+        sent_at = {}
+        window = asyncio.Semaphore(pipeline)
+
+        async def receive() -> None:
+            """Record the latency of each response."""
+
+            for _ in range(requests):
+                response = json.loads(await reader.readline())
+                latencies.append(time.perf_counter()
+                                 - sent_at.pop(response['id']))
+                window.release()
+
+        receiver = asyncio.ensure_future(receive())
+        for i in range(requests):
+            await window.acquire()
+            request_id = number * requests + i
+            sent_at[request_id] = time.perf_counter()
+            writer.write(json.dumps(make_request(request_id)).encode()
+                         + b'\n')
+            await writer.drain()
+        await receiver
+        writer.close()
+        await writer.wait_closed()
+
+    began = time.perf_counter()
+    await asyncio.gather(*[client(number) for number in range(clients)])
+    elapsed = time.perf_counter() - began
+
+    latencies.sort()
+    return {'requests': len(latencies),
+            'requests_per_second': len(latencies) / elapsed,
+            'p50_ms': _percentile(latencies, 50) * 1000,
+            'p99_ms': _percentile(latencies, 99) * 1000}
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    """Return the percent-th percentile of the sorted list values.
+
+    >>> _percentile([1.0, 2.0, 3.0, 4.0], 50)
+    2.0
+    """
+
+    if not values:
+        return 0.0
+    return values[max(0, round(len(values) * percent / 100) - 1)]
+
+
+def _load_stations(filename: str) -> StationTable:
+    """Return a StationTable of the stations in the CSV file filename."""
+
+    with open(filename) as stations_file:
+        return read_station_table(stations_file)
+
+
+async def _serve(arguments: argparse.Namespace) -> None:
+    """Serve the stations in arguments.stations until interrupted."""
+
+    service = StationService(_load_stations(arguments.stations))
+    server = await start_server(service, arguments.host, arguments.port)
+    async with server:
+        await server.serve_forever()
+
+
+async def _load(arguments: argparse.Namespace) -> Tuple[dict, int]:
+    """Start a server on arguments.stations, run the load generator against
+    it, and return its results and the number of rounds of
+    nearest-station requests the server answered.
+    """
+
+    stations = _load_stations(arguments.stations)
+    service = StationService(stations)
+    server = await start_server(service, arguments.host, 0)
+    port = server.sockets[0].getsockname()[1]
+    results = await run_load(arguments.host, port, arguments.clients,
+                             arguments.requests, arguments.pipeline,
+                             stations.to_list())
+    server.close()
+    await service.wait_closed()
+    return results, service.nearest_rounds
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('mode', choices=['serve', 'load'])
+    parser.add_argument('--stations', default='stations.csv')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--pipeline', type=int, default=16)
+    arguments = parser.parse_args()
+
+    if arguments.mode == 'serve':
+        asyncio.run(_serve(arguments))
+    else:
+        load_results, rounds = asyncio.run(_load(arguments))
+        print('{requests} requests, {requests_per_second:.0f} requests/s, '
+              'p50 {p50_ms:.2f} ms, p99 {p99_ms:.2f} ms'.format(
+                  **load_results))
+        print('nearest-station requests answered in {} rounds'.format(
+            rounds))
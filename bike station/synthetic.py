@@ -0,0 +1,65 @@
+"""Synthetic station networks for testing and benchmarking.
+
+Synthetic stations are made by copying stations from a real network (by
+default the bundled stations.csv) and moving each copy a short, random
+distance away, so the network keeps a realistic shape and density.
+"""
+
+import os
+import random
+from typing import List
+
+from bikes import (ID, NAME, LATITUDE, LONGITUDE, CAPACITY, BIKES_AVAILABLE,
+                   DOCKS_AVAILABLE, SAMPLE_STATIONS, read_stations)
+
+# The CSV file of real stations used to seed synthetic networks.
+STATIONS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'stations.csv')
+
+# The id of the first synthetic station.
+FIRST_SYNTHETIC_ID = 100000
+
+# The standard deviation, in degrees, of how far a synthetic station is
+# moved from the real station it copies.
+JITTER = 0.01
+
+
+def load_seed_stations() -> List["Station"]:
+    """Return the stations in STATIONS_FILE."""
+
+    with open(STATIONS_FILE) as stations_file:
+        return list(read_stations(stations_file))
+
+
+def synthetic_stations(n: int, seed_stations: List["Station"] = None,
+                       seed: int = 0) -> List["Station"]:
+    """Return a list of n synthetic stations based on the stations in
+    seed_stations, or on the stations in STATIONS_FILE if seed_stations is
+    None. The same seed always gives the same stations.
+
+    >>> stations = synthetic_stations(5, SAMPLE_STATIONS)
+    >>> [station[ID] for station in stations]
+    [100000, 100001, 100002, 100003, 100004]
+    >>> stations == synthetic_stations(5, SAMPLE_STATIONS)
+    True
+    >>> all(station[BIKES_AVAILABLE] + station[DOCKS_AVAILABLE] \
+            == station[CAPACITY] for station in stations)
+    True
+    """
+
+    if seed_stations is None:
+        seed_stations = load_seed_stations()
+
+    generator = random.Random(seed)
+    stations = []
+    for i in range(n):
+        original = generator.choice(seed_stations)
+        capacity = original[CAPACITY]
+        bikes = generator.randint(0, capacity)
+        stations.append([FIRST_SYNTHETIC_ID + i,
+                         '{} #{}'.format(original[NAME], i),
+                         round(generator.gauss(original[LATITUDE], JITTER), 6),
+                         round(generator.gauss(original[LONGITUDE], JITTER),
+                               6),
+                         capacity, bikes, capacity - bikes])
+    return stations
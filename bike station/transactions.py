@@ -0,0 +1,95 @@
+"""Apply batches of rentals and returns to stations in one pass.
+
+An event is a [kind, station id] pair, where kind is RENT or RETURN. A batch
+of events has the same effect, and gives the same result for each event, as
+calling rent_bike or return_bike for each event in order, but each station
+is looked up and updated only once per batch.
+"""
+
+import time
+from typing import Dict, List, NamedTuple
+
+from bikes import (ID, BIKES_AVAILABLE, DOCKS_AVAILABLE, SAMPLE_STATIONS,
+                   StationTable, find_station)
+
+RENT = 'rent'
+RETURN = 'return'
+
+
+class BatchResult(NamedTuple):
+    """The outcome of apply_events: whether each event succeeded, in the same
+    order as the events, and how long the batch took to apply.
+    """
+
+    results: List[bool]
+    seconds: float
+    events_per_second: float
+
+
+def apply_events(events: List[list], stations: List["Station"]) -> BatchResult:
+    """Apply the [kind, station id] events in events to stations in order,
+    as rent_bike and return_bike would, and return a BatchResult.
+
+    Precondition: the kind of each event is RENT or RETURN.
+
+    >>> sample_copy = [station[:] for station in SAMPLE_STATIONS]
+    >>> batch = apply_events([[RENT, 7090], [RETURN, 7571], [RENT, 7000], \
+                              [RETURN, 7090]], sample_copy)
+    >>> batch.results
+    [True, True, False, True]
+    >>> sample_copy[0] == SAMPLE_STATIONS[0]
+    True
+    >>> sample_copy[2][BIKES_AVAILABLE], sample_copy[2][DOCKS_AVAILABLE]
+    (15, 4)
+    """
+
+    began = time.perf_counter()
+    positions_by_station = {}
+    for position, (_, station_id) in enumerate(events):
+        positions_by_station.setdefault(station_id, []).append(position)
+
+    results = [False] * len(events)
+    found = _find_stations(list(positions_by_station), stations)
+    for station_id, positions in positions_by_station.items():
+        if station_id not in found:
+            continue
+        station = found[station_id]
+        bikes = station[BIKES_AVAILABLE]
+        docks = station[DOCKS_AVAILABLE]
+        for position in positions:
+            if events[position][0] == RENT:
+                if bikes > 0:
+                    bikes, docks = bikes - 1, docks + 1
+                    results[position] = True
+            elif docks > 0:
+                bikes, docks = bikes + 1, docks - 1
+                results[position] = True
+        if bikes != station[BIKES_AVAILABLE]:
+            station[BIKES_AVAILABLE] = bikes
+            station[DOCKS_AVAILABLE] = docks
+
+    seconds = time.perf_counter() - began
+    return BatchResult(results, seconds,
+                       len(events) / seconds if seconds > 0 else 0.0)
+
+
+def _find_stations(station_ids: List[int],
+                   stations: List["Station"]) -> Dict[int, "Station"]:
+    """Return a dict mapping each id in station_ids that is in stations to
+    the first station in stations with that id.
+    """
+
+    if isinstance(stations, StationTable):
+        found = {}
+        for station_id in station_ids:
+            station = find_station(station_id, stations)
+            if station is not None:
+                found[station_id] = station
+        return found
+
+    wanted = set(station_ids)
+    found = {}
+    for station in stations:
+        if station[ID] in wanted and station[ID] not in found:
+            found[station[ID]] = station
+    return found